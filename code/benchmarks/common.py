@@ -0,0 +1,136 @@
+# Shared helpers for the stitching benchmarks. Tiles are mapped straight from the frames of a sample directory
+# (the same way Stitcher.map_frames does) or from a synthetic grid cut out of a random texture at known offsets.
+
+import json
+import os
+import re
+import sys
+import time
+
+import cv2
+import numpy as np
+import tifffile
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import mosaic as mosaic_memmap
+import tile as tile_memmap
+
+FRAME_PATTERN = re.compile(r'frame_(-?\d+)_(-?\d+)')
+
+def get_frames(directory):
+    """Frames in a sample directory, sorted the same way as Stitcher.get_frames"""
+    files = [f for f in os.listdir(directory) if FRAME_PATTERN.match(f)]
+    return sorted(files, key=lambda f: (-1 * int(FRAME_PATTERN.match(f).group(1)), int(FRAME_PATTERN.match(f).group(2))))
+
+def load_metadata(directory):
+    with open(os.path.join(directory, "metadata.json")) as f:
+        return json.load(f)
+
+def load_mosaic(directory, tile_class=tile_memmap.MemmapOpenCVTile, overlap=None, **kwargs):
+    """Creates a MemmapStructuredMosaic from uncompressed frames mapped in place.
+
+    Args:
+        directory (str): Sample directory containing frame_*.tiff and metadata.json
+        tile_class (class, optional): Tile class to create. Defaults to MemmapOpenCVTile.
+        overlap (float, optional): Fraction of overlap to set on the tiles. Defaults to None.
+        **kwargs: Any keyword argument accepted by the tile class
+
+    Returns:
+        tuple: Mosaic and a dict mapping tile ids to frame names
+    """
+    metadata = load_metadata(directory)
+    names = get_frames(directory)
+    tiles = []
+    for name in names:
+        with tifffile.TiffFile(os.path.join(directory, name)) as tif:
+            page = tif.pages[0]
+            tile = tile_class(os.path.join(directory, name), page.shape, offset=page.dataoffsets[0], **kwargs)
+        tile.overlap = overlap
+        tiles.append(tile)
+
+    mosaic = mosaic_memmap.MemmapStructuredMosaic(tiles, dim=metadata["cols"])
+    return mosaic, {t.id: n for t, n in zip(tiles, names)}
+
+def make_synthetic_grid(directory, rows=5, cols=5, height=1080, width=1920, overlap=0.33, jitter=8, seed=0):
+    """Writes a grid of uncompressed frames cut out of a random texture at known positions.
+
+    Frames are named like the captures (frame_{row}_{col}_0.tiff, row increasing upwards) and the true position of
+    every frame is written to truth.json.
+
+    Args:
+        directory (str): Directory to write the frames to
+        rows (int, optional): Rows in the grid. Defaults to 5.
+        cols (int, optional): Columns in the grid. Defaults to 5.
+        height (int, optional): Frame height in pixels. Defaults to 1080.
+        width (int, optional): Frame width in pixels. Defaults to 1920.
+        overlap (float, optional): Nominal overlap between neighbors. Defaults to 0.33.
+        jitter (int, optional): Maximum error of the stage in pixels. Defaults to 8.
+        seed (int, optional): Random seed. Defaults to 0.
+
+    Returns:
+        dict: Frame names mapped to their (y, x) position
+    """
+    rng = np.random.default_rng(seed)
+    step_y = int(height * (1 - overlap))
+    step_x = int(width * (1 - overlap))
+    pad = 2 * jitter
+    canvas_h = step_y * (rows - 1) + height + 2 * pad
+    canvas_w = step_x * (cols - 1) + width + 2 * pad
+
+    # Blend blurred noise at two scales so the texture has both grain and larger structures
+    coarse = cv2.resize(rng.random((canvas_h // 8, canvas_w // 8, 3)).astype(np.float32), (canvas_w, canvas_h), interpolation=cv2.INTER_CUBIC)
+    fine = cv2.GaussianBlur(rng.random((canvas_h, canvas_w, 3)).astype(np.float32), (0, 0), 1.5)
+    canvas = 0.6 * coarse + 0.4 * fine
+    canvas = np.uint8(255 * (canvas - canvas.min()) / (canvas.max() - canvas.min()))
+
+    os.makedirs(directory, exist_ok=True)
+    truth = {}
+    coordinates = []
+    for row in range(rows):
+        for col in range(cols):
+            dy, dx = rng.integers(-jitter, jitter + 1, 2)
+            y = pad + (rows - 1 - row) * step_y + int(dy)
+            x = pad + col * step_x + int(dx)
+            name = "frame_{}_{}_0.tiff".format(row, col)
+            tifffile.imwrite(os.path.join(directory, name), canvas[y:y + height, x:x + width], photometric="rgb")
+            truth[name] = (y, x)
+            coordinates.append((x - int(dx), -(y - int(dy)), 0))
+
+    metadata = {"rows": rows, "cols": cols, "percent_overlap": int(overlap * 100), "coordinates": coordinates}
+    with open(os.path.join(directory, "metadata.json"), "w") as f:
+        json.dump(metadata, f, indent=4)
+    with open(os.path.join(directory, "truth.json"), "w") as f:
+        json.dump(truth, f, indent=4)
+
+    return truth
+
+def load_truth(directory):
+    """Loads the true frame positions written by make_synthetic_grid, or None for a real sample"""
+    path = os.path.join(directory, "truth.json")
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return {k: tuple(v) for k, v in json.load(f).items()}
+
+def neighbor_pairs(mosaic):
+    """All right and bottom neighbor pairs in the grid as (tile, neighbor)"""
+    pairs = []
+    for tile in mosaic.tiles:
+        neighbors = tile.neighbors()
+        for direction in ("right", "bottom"):
+            if direction in neighbors:
+                pairs.append((tile, neighbors[direction]))
+    return pairs
+
+def true_offset(truth, names, tile, other):
+    """True offset of tile relative to other as (dy, dx), with names mapping tile ids to frame names"""
+    y1, x1 = truth[names[tile.id]]
+    y2, x2 = truth[names[other.id]]
+    return y1 - y2, x1 - x2
+
+def timed(fn, *args, **kwargs):
+    """Runs fn and returns its result and the elapsed time in seconds"""
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, time.perf_counter() - start
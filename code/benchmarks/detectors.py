@@ -0,0 +1,82 @@
+# Benchmark of the feature detectors registered on MemmapOpenCVTile. For each detector, reports detection time per
+# tile, matching time per neighbor pair, the fraction of tiles placed by MemmapStructuredMosaic.align and the placement
+# error against a reference: the true positions of a synthetic grid, the coordinates in a params file saved by the
+# stitcher (--reference), or otherwise the placement found with the first detector.
+#
+# python benchmarks/detectors.py --synthetic /tmp/synthetic_grid
+# python benchmarks/detectors.py /path/to/sample --reference /path/to/sample/alignment_params.json
+
+import argparse
+import json
+
+import numpy as np
+
+import common
+import tile as tile_memmap
+
+def run(directory, detector, overlap):
+    """Detects, matches and aligns every tile with a detector
+
+    Returns:
+        tuple: Mosaic, dict mapping tile ids to frame names, ms per tile to detect and ms per pair to match
+    """
+    mosaic, names = common.load_mosaic(directory, detector=detector, overlap=overlap)
+
+    detect_times = [common.timed(t.detect_and_extract)[1] for t in mosaic.tiles]
+    match_times = [common.timed(n.estimate_offset, t)[1] for t, n in common.neighbor_pairs(mosaic)]
+
+    try:
+        mosaic.align()
+    except RuntimeError:
+        pass
+
+    return mosaic, names, 1000 * np.mean(detect_times), 1000 * np.mean(match_times)
+
+def positions(mosaic, names):
+    """Positions of the placed tiles as {frame name: (y, x)}"""
+    return {names[t.id]: (t.y, t.x) for t in mosaic.tiles if t.placed}
+
+def placement_error(placed, reference):
+    """Largest distance in pixels between placed and reference positions after removing their overall shift"""
+    common_names = [n for n in placed if n in reference]
+    if not common_names:
+        return None
+    diff = np.array([np.subtract(placed[n], reference[n]) for n in common_names])
+    return np.abs(diff - np.median(diff, axis=0)).max()
+
+def load_reference(path, mosaic, names):
+    """Loads the coordinates saved by MemmapMosaic.save_params as {frame name: (y, x)}"""
+    with open(path) as f:
+        coords = json.load(f)["coords"]
+    return {names[mosaic.tiles[int(i)].id]: tuple(yx) for i, yx in coords.items()}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("directory", help="sample directory containing frame_*.tiff and metadata.json")
+    parser.add_argument("--synthetic", action="store_true", help="write a synthetic grid to the directory first")
+    parser.add_argument("--overlap", type=float, default=0.33, help="overlap of the synthetic grid")
+    parser.add_argument("--reference", help="params file with reference coordinates for a real sample")
+    parser.add_argument("--detectors", nargs="+", default=list(tile_memmap.MemmapOpenCVTile.detectors),
+                        help="detectors to compare")
+    args = parser.parse_args()
+
+    if args.synthetic:
+        common.make_synthetic_grid(args.directory, overlap=args.overlap)
+
+    metadata = common.load_metadata(args.directory)
+    overlap = metadata["percent_overlap"] / 100
+    reference = common.load_truth(args.directory)
+
+    print("{:<10}{:>14}{:>14}{:>10}{:>14}".format("detector", "detect ms", "match ms", "placed", "max err px"))
+    for detector in args.detectors:
+        mosaic, names, detect_ms, match_ms = run(args.directory, detector, overlap)
+        placed = positions(mosaic, names)
+        if reference is None:
+            reference = load_reference(args.reference, mosaic, names) if args.reference else placed
+        error = placement_error(placed, reference)
+        print("{:<10}{:>14.1f}{:>14.1f}{:>10}{:>14}".format(
+            detector, detect_ms, match_ms, "{}/{}".format(len(placed), len(mosaic.tiles)),
+            "{:.2f}".format(error) if error is not None else "-"))
+
+if __name__ == "__main__":
+    main()
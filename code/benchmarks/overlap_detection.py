@@ -0,0 +1,65 @@
+# Benchmark of feature detection restricted to the overlap bands of each tile against full-frame detection.
+# Reports detection time, keypoint count and descriptor memory per tile, and how many neighbor pairs each mode
+# can place (and how accurately, if the sample is synthetic).
+#
+# python benchmarks/overlap_detection.py --synthetic /tmp/synthetic_grid --overlap 0.33
+# python benchmarks/overlap_detection.py /path/to/sample
+
+import argparse
+
+import numpy as np
+
+import common
+
+def detect(mosaic, overlap):
+    """Detects features in every tile and returns the time taken per tile"""
+    times = []
+    for tile in mosaic.tiles:
+        tile.overlap = overlap
+        tile.features_detected = None
+        _, elapsed = common.timed(tile.detect_and_extract)
+        times.append(elapsed)
+    return times
+
+def match(mosaic, names, truth):
+    """Estimates the offset of every neighbor pair, returning the number placed and the errors"""
+    placed = 0
+    errors = []
+    for tile, neighbor in common.neighbor_pairs(mosaic):
+        offset = neighbor.estimate_offset(tile)
+        if offset is None:
+            continue
+        placed += 1
+        if truth is not None:
+            dy, dx = common.true_offset(truth, names, neighbor, tile)
+            errors.append(max(abs(offset[0] - dy), abs(offset[1] - dx)))
+    return placed, errors
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("directory", help="sample directory containing frame_*.tiff and metadata.json")
+    parser.add_argument("--synthetic", action="store_true", help="write a synthetic grid to the directory first")
+    parser.add_argument("--overlap", type=float, default=0.33, help="overlap of the synthetic grid")
+    args = parser.parse_args()
+
+    if args.synthetic:
+        common.make_synthetic_grid(args.directory, overlap=args.overlap)
+
+    metadata = common.load_metadata(args.directory)
+    truth = common.load_truth(args.directory)
+    overlap = metadata["percent_overlap"] / 100
+    mosaic, names = common.load_mosaic(args.directory)
+    pairs = len(common.neighbor_pairs(mosaic))
+
+    print("{:<10}{:>14}{:>14}{:>16}{:>10}{:>14}".format("mode", "ms/tile", "keypoints", "descriptor MB", "placed", "max err px"))
+    for mode, value in (("full", None), ("overlap", overlap)):
+        times = detect(mosaic, value)
+        keypoints = np.mean([len(t.keypoints) for t in mosaic.tiles])
+        megabytes = sum(t.descriptors.nbytes for t in mosaic.tiles if t.features_detected) / 1e6
+        placed, errors = match(mosaic, names, truth)
+        print("{:<10}{:>14.1f}{:>14.0f}{:>16.2f}{:>10}{:>14}".format(
+            mode, 1000 * np.mean(times), keypoints, megabytes, "{}/{}".format(placed, pairs),
+            "{:.2f}".format(max(errors)) if errors else "-"))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+# Benchmark of phase-correlation alignment against feature matching. Reports the time per neighbor pair (including
+# feature detection, which phase correlation skips unless it falls back), how many pairs each method places, how many
+# pairs needed the feature-matching fallback, and the error against the true offsets if the sample is synthetic.
+#
+# python benchmarks/phase_correlation.py --synthetic /tmp/synthetic_grid --overlap 0.33
+# python benchmarks/phase_correlation.py /path/to/sample
+
+import argparse
+
+import numpy as np
+
+import common
+import tile as tile_memmap
+
+def align_pairs(mosaic, names, truth):
+    """Detects features and estimates the offset of every neighbor pair
+
+    Returns:
+        tuple: Seconds per pair, pairs placed, pairs that fell back to feature matching and errors in pixels
+    """
+    pairs = common.neighbor_pairs(mosaic)
+    _, elapsed = common.timed(lambda: [t.detect_and_extract() for t in mosaic.tiles])
+
+    placed = 0
+    fallback = 0
+    errors = []
+    for tile, neighbor in pairs:
+        offset, seconds = common.timed(neighbor.estimate_offset, tile)
+        elapsed += seconds
+        if isinstance(neighbor, tile_memmap.MemmapPhaseCorrelationTile):
+            _, confidence = neighbor.phase_correlate(tile, neighbor.expected_offset(tile))
+            fallback += confidence < neighbor.min_confidence
+        if offset is None:
+            continue
+        placed += 1
+        if truth is not None:
+            dy, dx = common.true_offset(truth, names, neighbor, tile)
+            errors.append(max(abs(offset[0] - dy), abs(offset[1] - dx)))
+    return elapsed / len(pairs), placed, fallback, errors
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("directory", help="sample directory containing frame_*.tiff and metadata.json")
+    parser.add_argument("--synthetic", action="store_true", help="write a synthetic grid to the directory first")
+    parser.add_argument("--overlap", type=float, default=0.33, help="overlap of the synthetic grid")
+    args = parser.parse_args()
+
+    if args.synthetic:
+        common.make_synthetic_grid(args.directory, overlap=args.overlap)
+
+    metadata = common.load_metadata(args.directory)
+    truth = common.load_truth(args.directory)
+    overlap = metadata["percent_overlap"] / 100
+
+    print("{:<8}{:>14}{:>10}{:>12}{:>14}{:>14}".format("method", "ms/pair", "placed", "fallback", "mean err px", "max err px"))
+    for method, tile_class in (("sift", tile_memmap.MemmapOpenCVTile), ("phase", tile_memmap.MemmapPhaseCorrelationTile)):
+        mosaic, names = common.load_mosaic(args.directory, tile_class=tile_class, overlap=overlap)
+        seconds, placed, fallback, errors = align_pairs(mosaic, names, truth)
+        print("{:<8}{:>14.1f}{:>10}{:>12}{:>14}{:>14}".format(
+            method, 1000 * seconds, "{}/{}".format(placed, len(common.neighbor_pairs(mosaic))),
+            fallback if method == "phase" else "-",
+            "{:.2f}".format(np.mean(errors)) if errors else "-",
+            "{:.2f}".format(max(errors)) if errors else "-"))
+
+if __name__ == "__main__":
+    main()
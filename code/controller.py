@@ -515,8 +515,24 @@ class Controller:
             start_time = time.time()
 
             sample.set_start_time_imaging(start_time)
+
+            # Kept frames are aligned while capturing, so stitching only draws the mosaic, or at least their
+            # features are cached so stitching can skip detection. Frames are aligned by features while capturing,
+            # so the placement is only reused by stitches that align by features too.
+            filler = None
+            on_focused = None
+            stitcher_config = self.config["stitcher"]
+            if (stitcher_config["FEATURE_CACHE"] and stitcher_config["INCREMENTAL_ALIGNMENT"]
+                    and stitcher_config["REUSE_ALIGNMENT"] and stitcher_config["ALIGNER"] == "features"):
+                filler = stitcher.IncrementalAligner(sample, min(self.stitch_sizes))
+            elif stitcher_config["FEATURE_CACHE"] and stitcher_config["PREFILL_FEATURE_CACHE"]:
+                filler = stitcher.FeatureCacheFiller(sample, min(self.stitch_sizes))
+            if filler is not None:
+                filler.start()
+                on_focused = filler.add
+
             gantry_thread = Thread(target=self.capture_grid_photos, args=(sample, focus_queue, pid_queue, pid_lock, progress_callback, stop_capture))
-            focus_thread = Thread(target=self.focus.find_focus, args=(sample, focus_queue, pid_queue, pid_lock))
+            focus_thread = Thread(target=self.focus.find_focus, args=(sample, focus_queue, pid_queue, pid_lock, on_focused))
             gantry_thread.start()
             focus_thread.start()
             
@@ -524,6 +540,9 @@ class Controller:
             focus_queue.join()    	
             focus_thread.join()
 
+            if filler is not None:
+                filler.stop()
+
             end_time = time.time()
             sample.set_end_time_imaging(end_time)
             sample.to_json()
@@ -596,8 +615,13 @@ class Controller:
             sample (str): sample.Sample which is being stitched.. 
         """
 
-        for size in self.stitch_sizes:
-            st = stitcher.Stitcher(sample) 
+        # Smallest first, so the coarse alignment cached by the first stitch is reused by the larger ones
+        for size in sorted(self.stitch_sizes):
+            # Cores are a single column of frames, which only need to be placed one below the other
+            if sample.is_core and self.config["stitcher"]["STRIP_STITCH_CORES"]:
+                st = stitcher.StripStitcher(sample)
+            else:
+                st = stitcher.Stitcher(sample)
             #st.stitch(resize=size)
             try:
                 sample.set_dpi(size, self.max_dpi)
@@ -0,0 +1,223 @@
+"""Stores tile features in memory-mapped files shared by every worker"""
+import hashlib
+import json
+import logging
+import os
+import shutil
+import threading
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class FeatureStore:
+    """Keeps the keypoints and descriptors of tiles in .npy files
+
+    Workers write the features of a tile once and any process can map them
+    back by tile id, so features never have to be pickled between the
+    mosaic and its worker pool. Only the directory is pickled with the
+    store.
+
+    Attributes
+    ----------
+    directory : str
+        directory containing the .npy files
+    """
+
+    def __init__(self, directory):
+        """Initializes a store in the given directory
+
+        Parameters
+        ----------
+        directory : str
+            directory for the .npy files. Created if it does not exist.
+        """
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def __str__(self):
+        return f"<{self.__class__.__name__} directory={self.directory}>"
+
+    def path(self, tile_id, kind):
+        """Gets the path of the keypoints or descriptors of a tile
+
+        Parameters
+        ----------
+        tile_id : uuid.UUID or str
+            id of the tile
+        kind : str
+            either "keypoints" or "descriptors"
+
+        Returns
+        -------
+        str
+            path to the .npy file
+        """
+        return os.path.join(self.directory, f"{tile_id}_{kind}.npy")
+
+    def save(self, tile_id, keypoints, descriptors):
+        """Writes the features of a tile
+
+        Each array is written to a temporary file and moved into place, so
+        readers never see a partially written file.
+
+        Parameters
+        ----------
+        tile_id : uuid.UUID or str
+            id of the tile
+        keypoints : numpy.ndarray
+            keypoints of the tile
+        descriptors : numpy.ndarray
+            descriptors of the tile
+        """
+        for kind, arr in (("keypoints", keypoints), ("descriptors", descriptors)):
+            path = self.path(tile_id, kind)
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, "wb") as f:
+                np.save(f, arr)
+            os.replace(tmp_path, path)
+
+    def load(self, tile_id, kind):
+        """Maps the keypoints or descriptors of a tile
+
+        Parameters
+        ----------
+        tile_id : uuid.UUID or str
+            id of the tile
+        kind : str
+            either "keypoints" or "descriptors"
+
+        Returns
+        -------
+        numpy.ndarray
+            read-only memmap of the array, or None if the tile has no
+            features in the store
+        """
+        try:
+            return np.load(self.path(tile_id, kind), mmap_mode="r")
+        except FileNotFoundError:
+            return None
+
+    def contains(self, tile_id):
+        """Tests if the store holds the features of a tile"""
+        return os.path.exists(self.path(tile_id, "descriptors"))
+
+    def delete(self, tile_id):
+        """Removes the features of a tile from the store"""
+        for kind in ("keypoints", "descriptors"):
+            try:
+                os.remove(self.path(tile_id, kind))
+            except FileNotFoundError:
+                pass
+
+    def clear(self):
+        """Removes the store and all features in it"""
+        shutil.rmtree(self.directory, ignore_errors=True)
+        logger.info(f"Cleared {self}")
+
+
+class FeatureCache(FeatureStore):
+    """A persistent feature store keyed by frame content and detection parameters
+
+    Features are stored under a key built from a hash of the frame file and
+    the parameters that affect detection, so they can be reused by any later
+    stitch of the same frames and filled in before the stitch starts. Frame
+    hashes are remembered while the size and modification time of the frame
+    are unchanged, so frames are only read once. Each hash is kept in a small
+    file of its own, so remembering one costs the same however many frames
+    the cache holds.
+
+    Attributes
+    ----------
+    directory : str
+        directory containing the .npy files
+    """
+
+    #: str : included in every key. Bump when detection changes in a way the
+    #: parameters do not capture to invalidate existing caches.
+    version = "1"
+
+    def __init__(self, directory):
+        """Initializes a cache in the given directory
+
+        Parameters
+        ----------
+        directory : str
+            directory for the .npy files. Created if it does not exist.
+        """
+        super().__init__(directory)
+        self._hashes_directory = os.path.join(directory, "frame_hashes")
+        self._hashes = {}
+
+    def frame_hash(self, path, chunk_size=1 << 20):
+        """Hashes the content of a frame
+
+        Parameters
+        ----------
+        path : str
+            path to the frame
+        chunk_size : int
+            number of bytes read at a time
+
+        Returns
+        -------
+        str
+            SHA-1 hex digest of the file
+        """
+        stat = os.stat(path)
+        name = os.path.basename(path)
+        hash_path = os.path.join(self._hashes_directory, f"{name}.json")
+
+        # Hashes may have been remembered by another process, e.g. during capture
+        entry = self._hashes.get(name)
+        if entry is None:
+            try:
+                with open(hash_path, encoding="utf-8") as f:
+                    entry = json.load(f)
+            except (FileNotFoundError, ValueError):
+                pass
+        if entry and entry["size"] == stat.st_size and entry["mtime_ns"] == stat.st_mtime_ns:
+            self._hashes[name] = entry
+            return entry["hash"]
+
+        digest = hashlib.sha1()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(chunk_size), b""):
+                digest.update(chunk)
+
+        entry = {
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+            "hash": digest.hexdigest(),
+        }
+        self._hashes[name] = entry
+
+        os.makedirs(self._hashes_directory, exist_ok=True)
+        tmp_path = f"{hash_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(entry, f)
+        os.replace(tmp_path, hash_path)
+
+        return entry["hash"]
+
+    def key(self, frame_hash, **params):
+        """Builds the key for the features of a frame
+
+        Parameters
+        ----------
+        frame_hash : str
+            hash of the frame. See frame_hash.
+        **params :
+            JSON-serializable parameters that affect detection, such as the
+            detector, the scale of the tile and the regions searched
+
+        Returns
+        -------
+        str
+            SHA-1 hex digest identifying the features
+        """
+        text = json.dumps(
+            {"frame": frame_hash, "version": self.version, **params}, sort_keys=True
+        )
+        return hashlib.sha1(text.encode("utf-8")).hexdigest()
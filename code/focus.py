@@ -25,7 +25,7 @@ class Focus:
         self.PID = AsynchronousPID(Kp=self.kp, Ki=self.ki, Kd=self.kd, setpoint=setpoint) 
         self.TESTINGLOG = []
 
-    def find_focus(self, sample: sample.Sample, focus_queue, pid_queue, pid_lock):
+    def find_focus(self, sample: sample.Sample, focus_queue, pid_queue, pid_lock, on_focused=None):
         while True:
             image_files = focus_queue.get()
             pid_lock.acquire()
@@ -47,6 +47,10 @@ class Focus:
                 Path("{}/focused_images".format(self.directory)).mkdir(exist_ok=True)
                 shutil.copy(focused_image_name, "{}/focused_images/{}".format(sample.directory,filename))
             
+            # Hand the kept frame on, e.g. to detect its features while the gantry moves
+            if on_focused is not None:
+                on_focused(focused_image_name)
+
             sample.background_std.append(std)
             sample.background.append(self.is_background(std))
             sample.focus_index.append(stack_number)
@@ -0,0 +1,185 @@
+"""Keeps stitching within a memory budget"""
+from contextlib import contextmanager
+import gc
+import logging
+import threading
+
+import psutil
+
+from features import FeatureStore
+
+logger = logging.getLogger(__name__)
+
+
+class MemoryGovernor:
+    """Sizes batches of tile work to fit a resident memory budget
+
+    The memory used by a tile is measured while batches run: the peak rise
+    in resident memory during a batch is spread over the tiles processed at
+    once and what is still held afterwards over every tile in the batch.
+    Batches are then sized so the next one fits in the memory left under
+    the budget. Resident memory includes worker processes.
+
+    Attributes
+    ----------
+    budget : int
+        resident memory budget in bytes
+    workers : int
+        number of workers running tiles at the same time
+    min_batch : int
+        smallest batch returned, even over budget
+    max_batch : int
+        largest batch returned
+    spill_directory : str
+        directory for features moved out of memory by relieve
+    per_tile : float
+        measured bytes needed per tile, or None before the first batch
+    """
+
+    #: float : Fraction of the budget batches are sized to, leaving room for
+    #: memory not tracked per tile
+    headroom = 0.9
+
+    #: float : Seconds between samples of resident memory while a batch runs
+    interval = 0.02
+
+    def __init__(self, budget, workers=1, min_batch=1, max_batch=64, spill_directory=None):
+        """Initializes a governor
+
+        Parameters
+        ----------
+        budget : int
+            resident memory budget in bytes
+        workers : int
+            number of workers running tiles at the same time. Used as the
+            size of the first batch, before any tile has been measured.
+        min_batch : int
+            smallest batch returned, even over budget
+        max_batch : int
+            largest batch returned
+        spill_directory : str
+            directory for features moved out of memory by relieve. Features
+            are freed instead if not given.
+        """
+        self.budget = budget
+        self.workers = workers
+        self.min_batch = min_batch
+        self.max_batch = max_batch
+        self.spill_directory = spill_directory
+        self.per_tile = None
+        self._spill_store = None
+
+    def __str__(self):
+        return f"<{self.__class__.__name__} budget={self.budget / 1e9:.1f} GB>"
+
+    @staticmethod
+    def rss():
+        """Measures resident memory of this process and its workers
+
+        Returns
+        -------
+        int
+            resident memory in bytes
+        """
+        process = psutil.Process()
+        rss = process.memory_info().rss
+        for child in process.children(recursive=True):
+            try:
+                rss += child.memory_info().rss
+            except psutil.Error:
+                pass
+        return rss
+
+    def available(self):
+        """Calculates the memory left under the budget
+
+        Returns
+        -------
+        int
+            bytes left, which is negative if over budget
+        """
+        return int(self.headroom * self.budget) - self.rss()
+
+    def under_pressure(self):
+        """Whether resident memory is over the budget less headroom"""
+        return self.available() < 0
+
+    def batch_size(self):
+        """Sizes the next batch to fit the memory left under the budget
+
+        Returns
+        -------
+        int
+            number of tiles to process in the next batch
+        """
+        if self.per_tile is None:
+            size = self.workers
+        else:
+            size = int(self.available() / self.per_tile)
+        return max(self.min_batch, min(self.max_batch, size))
+
+    @contextmanager
+    def track(self, size):
+        """Measures the memory used per tile by a batch
+
+        Parameters
+        ----------
+        size : int
+            number of tiles in the batch
+        """
+        start = self.rss()
+        peak = [start]
+        done = threading.Event()
+
+        def sample():
+            while not done.wait(self.interval):
+                peak[0] = max(peak[0], self.rss())
+
+        sampler = threading.Thread(target=sample, daemon=True)
+        sampler.start()
+        try:
+            yield
+        finally:
+            done.set()
+            sampler.join()
+
+        end = self.rss()
+        peak = max(peak[0], end)
+        concurrent = max(1, min(size, self.workers))
+        per_tile = max(peak - start, 0) / concurrent + max(end - start, 0) / max(size, 1)
+
+        # Keep the larger of the new and previous estimates while decaying
+        # slowly, so a quiet batch does not let the next one overshoot
+        if self.per_tile is None:
+            self.per_tile = per_tile
+        else:
+            self.per_tile = max(per_tile, 0.75 * self.per_tile)
+
+    def relieve(self, tiles):
+        """Moves features held in memory out to disk
+
+        Parameters
+        ----------
+        tiles : list of MemmapTile
+            tiles whose features can be moved, typically placed tiles
+        """
+        before = self.rss()
+        if self.spill_directory is not None and self._spill_store is None:
+            self._spill_store = FeatureStore(self.spill_directory)
+
+        count = 0
+        for tile in tiles:
+            if tile.spill_features(self._spill_store):
+                count += 1
+        gc.collect()
+
+        logger.info(
+            f"Spilled features of {count} tiles, resident memory"
+            f" {before / 1e9:.2f} GB -> {self.rss() / 1e9:.2f} GB"
+        )
+
+    def clear(self):
+        """Removes features spilled to disk"""
+        if self._spill_store is not None:
+            self._spill_store.clear()
+            self._spill_store = None
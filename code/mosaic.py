@@ -2,6 +2,8 @@
 
 """Reads and stitches images from a 2D grid into a mosaic"""
 from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+import copy
 from itertools import chain
 import glob
 import imghdr
@@ -12,6 +14,9 @@ import re
 
 from joblib import Parallel, delayed
 import numpy as np
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+from scipy.sparse.linalg import lsqr, spsolve
 
 from tile import Tile, OpenCVTile, MemmapOpenCVTile, MemmapTile
 
@@ -329,8 +334,12 @@ class Mosaic:
             batch=[t for t in self.tiles if not t.features_detected],
         )
 
-    def align(self, origin=None, limit=None, **kwargs):
-        """Builds a mosaic by checking each tile against all others
+    def align(self, origin=None, limit=None, neighbors=4, **kwargs):
+        """Builds a mosaic by matching each tile against nearby placed tiles
+
+        Candidates are matched against the features of individual placed
+        tiles, never against a composite of them, so each pair of tiles is
+        compared at most once.
 
         Parameters
         ----------
@@ -342,6 +351,10 @@ class Mosaic:
             method finishes. If not given, the method will continue until
             it runs out of adjacent tiles with matching features. Setting
             a limit allows a decent mosaic to be created quickly.
+        neighbors : int
+            the number of nearby placed tiles a candidate with stage priors
+            is matched against, and the length of the shortlists used for
+            tiles without them. See match_partners.
         kwargs :
             any keyword argument accepted by the align_to method on the
             Tiles comprising this mosaic
@@ -364,6 +377,17 @@ class Mosaic:
         if tiles[0].x is None:
             tiles[0].x = 0
 
+        # Tiles without priors are first matched against the tiles whose
+        # features most resemble theirs
+        shortlists = None
+        if not all(getattr(t, "has_prior", False) for t in candidates):
+            shortlists = tile_shortlists(
+                list({t.id: t for t in tiles + candidates}.values()), neighbors
+            )
+
+        placed = list(tiles)
+        tried = set()
+
         while tiles and candidates:
 
             # Stop aligning if limit is reached
@@ -373,20 +397,31 @@ class Mosaic:
                 )
                 break
 
-            if len(tiles) == 1:
-                tile = tiles[0]
-            else:
-                tile = self.tile_class(tiles[0].draw(tiles[1:]))
-                tile.detect_and_extract()
-
-                tile.y = min([t.y for t in tiles])
-                tile.x = min([t.x for t in tiles])
-
-            self._batch_tile_method("align_to", tile, batch=candidates, **kwargs)
+            # Match each candidate against one partner at a time, so a tile
+            # is only ever aligned by one job in a batch
+            partners = match_partners(
+                candidates, tiles, placed, tried, neighbors, shortlists
+            )
+            for i in range(max([len(p) for p in partners.values()], default=0)):
+                batch = [
+                    t for t in candidates if not t.placed and len(partners[t.id]) > i
+                ]
+                self._batch_tile_method(
+                    "align_to",
+                    [partners[t.id][i] for t in batch],
+                    batch=batch,
+                    **kwargs,
+                )
 
             # Remove newly placed tiles from candidates
             tiles = [t for t in candidates if t.placed]
             candidates = [t for t in candidates if not t.placed]
+            placed.extend(tiles)
+
+            # Once the shortlists place no more tiles, match what is left
+            # against every placed tile
+            if not tiles and shortlists:
+                tiles, shortlists = list(placed), None
 
         else:
             if limit is not None:
@@ -414,8 +449,10 @@ class Mosaic:
         """
 
         tiles = [self._get_origin() if origin is None else origin]
-        placed = [t for t in self.tiles if t.placed and t not in tiles]
-        smoothed = []
+        index = SpatialIndex(
+            [t for t in self.tiles if t.placed and t.id != tiles[0].id]
+        )
+        smoothed = set()
 
         min_xtn = 0
 
@@ -428,15 +465,12 @@ class Mosaic:
                 # Corner-to-corner matches can give bad results, so
                 # exclude small-area matches. This could cause problems
                 # with non-gridded tilesets.
-                xing = [t for t in placed if t.intersects(tile)]
+                xing = index.query(tile.bounds())
                 if not min_xtn and len(xing) > 4:
-                    xtns = [t.intersection(tile)[0].size for t in xing]
-                    min_xtn = min(xtns) * 1.5
+                    min_xtn = min(area for _, area in xing) * 1.5
 
-                xing = [t for t in xing if t.intersection(tile)[0].size > min_xtn]
-
-                for neighbor in xing:
-                    if neighbor not in smoothed:
+                for neighbor, area in xing:
+                    if area > min_xtn and neighbor.id not in smoothed:
                         unique.setdefault(neighbor.id, (tile, neighbor))
 
             batch = list(unique.values())
@@ -445,7 +479,7 @@ class Mosaic:
             )
 
             tiles = [n for _, n in batch]
-            smoothed.extend(tiles)
+            smoothed.update(t.id for t in tiles)
 
         logger.info(f"Smoothed seams in {self}")
 
@@ -748,6 +782,15 @@ class MemmapMosaic:
     #: int : Number of cores to use when processing images
     num_cores = 1
 
+    #: MemoryGovernor : if set, sizes batches of tile work to fit a memory
+    #: budget instead of using a fixed batch size
+    governor = None
+
+    #: dict : JSON-serializable settings the placement depends on, such as
+    #: the aligner and a digest of the frames. Saved with the params and
+    #: compared with them on load.
+    settings = None
+
     def __init__(self, path_or_tiles, tile_class=None):
         """Initializes a mosaic from a list of tiles
 
@@ -834,7 +877,7 @@ class MemmapMosaic:
         filenames = {}
         for i, tile in enumerate(self.tiles):
             if tile.placed:
-                coords[i] = [tile.y / tile.scale, tile.x / tile.scale]
+                coords[i] = [float(tile.y / tile.scale), float(tile.x / tile.scale)]
             if isinstance(tile.source, str):
                 filenames[i] = os.path.basename(tile.source)
 
@@ -842,7 +885,11 @@ class MemmapMosaic:
             "metadata": {
                 "shape": list(self.shape),
                 "size": self.size,
-                "tile_shape": list(self.tiles[0].copy().reset().shape[:2]),
+                "tile_shape": [
+                    int(round(self.tiles[0].height / self.tiles[0].scale)),
+                    int(round(self.tiles[0].width / self.tiles[0].scale)),
+                ],
+                **(self.settings or {}),
             },
             "coords": coords,
         }
@@ -983,7 +1030,9 @@ class MemmapMosaic:
                     f"JSON param '{key}' does not match this mosaic"
                     f" ({val} != {path_or_obj.get('metadata', {}).get(key)})"
                 )
-                logger.error(msg)
+                # Params saved with other settings are expected, they are
+                # aligned again by the caller
+                logger.info(msg)
                 raise ValueError(msg)
 
         # Mosaics are similar, so update tile coordinates from params
@@ -1046,8 +1095,12 @@ class MemmapMosaic:
             batch=[t for t in self.tiles if not t.features_detected],
         )
 
-    def align(self, origin=None, limit=None, **kwargs):
-        """Builds a mosaic by checking each tile against all others
+    def align(self, origin=None, limit=None, neighbors=4, **kwargs):
+        """Builds a mosaic by matching each tile against nearby placed tiles
+
+        Candidates are matched against the features of individual placed
+        tiles, never against a composite of them, so each pair of tiles is
+        compared at most once.
 
         Parameters
         ----------
@@ -1059,6 +1112,10 @@ class MemmapMosaic:
             method finishes. If not given, the method will continue until
             it runs out of adjacent tiles with matching features. Setting
             a limit allows a decent mosaic to be created quickly.
+        neighbors : int
+            the number of nearby placed tiles a candidate with stage priors
+            is matched against, and the length of the shortlists used for
+            tiles without them. See match_partners.
         kwargs :
             any keyword argument accepted by the align_to method on the
             Tiles comprising this mosaic
@@ -1081,6 +1138,21 @@ class MemmapMosaic:
         if tiles[0].x is None:
             tiles[0].x = 0
 
+        # Rows and columns of an unstructured mosaic are arbitrary, so only
+        # stage priors may constrain matching
+        kwargs.setdefault("constrained", False)
+
+        # Tiles without priors are first matched against the tiles whose
+        # features most resemble theirs
+        shortlists = None
+        if not all(getattr(t, "has_prior", False) for t in candidates):
+            shortlists = tile_shortlists(
+                list({t.id: t for t in tiles + candidates}.values()), neighbors
+            )
+
+        placed = list(tiles)
+        tried = set()
+
         while tiles and candidates:
 
             # Stop aligning if limit is reached
@@ -1090,20 +1162,31 @@ class MemmapMosaic:
                 )
                 break
 
-            if len(tiles) == 1:
-                tile = tiles[0]
-            else:
-                tile = self.tile_class(tiles[0].draw(tiles[1:]))
-                tile.detect_and_extract()
-
-                tile.y = min([t.y for t in tiles])
-                tile.x = min([t.x for t in tiles])
-
-            self._batch_tile_method("align_to", tile, batch=candidates, **kwargs)
+            # Match each candidate against one partner at a time, so a tile
+            # is only ever aligned by one job in a batch
+            partners = match_partners(
+                candidates, tiles, placed, tried, neighbors, shortlists
+            )
+            for i in range(max([len(p) for p in partners.values()], default=0)):
+                batch = [
+                    t for t in candidates if not t.placed and len(partners[t.id]) > i
+                ]
+                self._batch_tile_method(
+                    "align_to",
+                    [partners[t.id][i] for t in batch],
+                    batch=batch,
+                    **kwargs,
+                )
 
             # Remove newly placed tiles from candidates
             tiles = [t for t in candidates if t.placed]
             candidates = [t for t in candidates if not t.placed]
+            placed.extend(tiles)
+
+            # Once the shortlists place no more tiles, match what is left
+            # against every placed tile
+            if not tiles and shortlists:
+                tiles, shortlists = list(placed), None
 
         else:
             if limit is not None:
@@ -1131,8 +1214,10 @@ class MemmapMosaic:
         """
 
         tiles = [self._get_origin() if origin is None else origin]
-        placed = [t for t in self.tiles if t.placed and t not in tiles]
-        smoothed = []
+        index = SpatialIndex(
+            [t for t in self.tiles if t.placed and t.id != tiles[0].id]
+        )
+        smoothed = set()
 
         min_xtn = 0
 
@@ -1145,15 +1230,12 @@ class MemmapMosaic:
                 # Corner-to-corner matches can give bad results, so
                 # exclude small-area matches. This could cause problems
                 # with non-gridded tilesets.
-                xing = [t for t in placed if t.intersects(tile)]
+                xing = index.query(tile.bounds())
                 if not min_xtn and len(xing) > 4:
-                    xtns = [t.intersection(tile)[0].size for t in xing]
-                    min_xtn = min(xtns) * 1.5
+                    min_xtn = min(area for _, area in xing) * 1.5
 
-                xing = [t for t in xing if t.intersection(tile)[0].size > min_xtn]
-
-                for neighbor in xing:
-                    if neighbor not in smoothed:
+                for neighbor, area in xing:
+                    if area > min_xtn and neighbor.id not in smoothed:
                         unique.setdefault(neighbor.id, (tile, neighbor))
 
             batch = list(unique.values())
@@ -1162,13 +1244,72 @@ class MemmapMosaic:
             )
 
             tiles = [n for _, n in batch]
-            smoothed.extend(tiles)
+            smoothed.update(t.id for t in tiles)
 
         logger.info(f"Smoothed seams in {self}")
 
-    def stitch(self, path):
+    def compensate_gains(self, step=8, sigma_n=10.0, sigma_g=0.1):
+        """Evens out brightness between tiles by solving for a gain per tile
+
+        The mean intensity of each pair of overlapping tiles is measured on
+        a sparse sample of their overlap and the gains that best equalize
+        every overlap at once are found by least squares. Gains are stored
+        on the tiles and applied as the mosaic is drawn, so no adjusted copy
+        of a tile is ever written. See solve_gains.
+
+        Parameters
+        ----------
+        step : int
+            sampling interval in pixels within each overlap
+        sigma_n : float
+            expected noise in the mean intensity of an overlap
+        sigma_g : float
+            expected spread of the gains around 1
+        """
+        placed = [t for t in self.tiles if t.placed]
+        if len(placed) < 2:
+            return
+
+        index = SpatialIndex(placed)
+        order = {t.id: i for i, t in enumerate(placed)}
+        pairs = []
+        for tile in placed:
+            for other, _ in index.query(tile.bounds()):
+                if order[other.id] > order[tile.id]:
+                    pairs.append((tile, other))
+
+        results = self.pool(
+            delayed(tile.overlap_means)(other, step) for tile, other in pairs
+        )
+
+        stats = [
+            (order[tile.id], order[other.id], *result)
+            for (tile, other), result in zip(pairs, results)
+            if result is not None
+        ]
+        gains = solve_gains(len(placed), stats, sigma_n=sigma_n, sigma_g=sigma_g)
+        for tile, gain in zip(placed, gains):
+            tile.gain = gain
+
+        logger.info(
+            f"Compensated gains in {self} from {len(stats)} overlaps"
+            f" (range {gains.min():.3f}-{gains.max():.3f})"
+        )
+
+    def stitch(self, path, cells=False, **kwargs):
         """Stitches mosaic using either placed tiles or row/col of tiles
 
+        Parameters
+        ----------
+        path : str
+            path to the memmap
+        cells : bool
+            whether each tile only draws its own cell. See
+            MemmapTile.draw_memmap.
+        kwargs :
+            any keyword argument accepted by MemmapTile.draw_memmap, such
+            as the band height, workers and memory cap
+
         Returns
         -------
         None
@@ -1191,7 +1332,7 @@ class MemmapMosaic:
 
         self._normalize_coordinates()
 
-        shape = placed[0].draw_memmap(placed[1:], path)
+        shape = placed[0].draw_memmap(placed[1:], path, cells=cells, **kwargs)
 
         # Reset tile x and y to None if set above
         if reset_xy:
@@ -1203,15 +1344,20 @@ class MemmapMosaic:
 
         return shape
 
-    def save(self, path=None):
+    def save(self, path=None, cells=False, **kwargs):
         """Saves mosaic to path
 
         Parameters
         ----------
         path : str
             file path
+        cells : bool
+            whether each tile only draws its own cell. See
+            MemmapTile.draw_memmap.
+        kwargs :
+            any keyword argument accepted by MemmapTile.draw_memmap
         """
-        shape = self.stitch(path)
+        shape = self.stitch(path, cells=cells, **kwargs)
         return shape
 
     def show(self, *args, **kwargs):
@@ -1282,6 +1428,33 @@ class MemmapMosaic:
 
         logger.info(f"Finished running tile.{method}() ({len(batch)} tiles)")
 
+    def _slices(self, items, batch_size):
+        """Splits work into batches, sized by the governor if one is set
+
+        Parameters
+        ----------
+        items : list
+            tiles or pairs of tiles to process
+        batch_size : int
+            size of each batch if there is no governor
+
+        Yields
+        ------
+        list
+            the next batch of items. The governor measures the memory used
+            while the batch is processed.
+        """
+        i = 0
+        while i < len(items):
+            if self.governor is None:
+                yield items[i:i + batch_size]
+                i += batch_size
+            else:
+                size = self.governor.batch_size()
+                with self.governor.track(min(size, len(items) - i)):
+                    yield items[i:i + size]
+                i += size
+
     def _build_grid(self, path_or_tiles):
         """Builds grid and populates related attributes"""
 
@@ -1803,8 +1976,127 @@ class MemmapStructuredMosaic(MemmapMosaic):
                 tile.row = y
                 tile.col = x
                 tile.grid = self.grid
+    def save_checkpoint(self, path, wavefront, cleared=(), phase="align"):
+        """Saves the progress of align so it can be resumed after a crash
+
+        The checkpoint holds the coordinates of the placed tiles, the tiles
+        to align from next and which tiles have had features detected. It is
+        written to a temporary file and moved into place, so an interrupted
+        save leaves the previous checkpoint intact.
+
+        Parameters
+        ----------
+        path : str
+            path to the JSON file
+        wavefront : list of Tile
+            tiles whose neighbors will be aligned next
+        cleared : iterable of Tile
+            tiles whose features were freed because all of their neighbors
+            are placed
+        phase : str
+            what is being aligned, either "align" or "refine". A checkpoint
+            only resumes the same phase.
+        """
+        index = {tile.id: i for i, tile in enumerate(self.tiles)}
+        checkpoint = {
+            "metadata": self._checkpoint_metadata(phase),
+            "coords": {
+                i: [float(tile.y), float(tile.x)]
+                for i, tile in enumerate(self.tiles)
+                if tile.placed
+            },
+            "wavefront": [index[tile.id] for tile in wavefront],
+            "features": {
+                i: bool(tile.features_detected)
+                for i, tile in enumerate(self.tiles)
+                if tile.features_detected is not None
+            },
+            "cleared": [index[tile.id] for tile in cleared],
+        }
+
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(checkpoint, f)
+        os.replace(tmp_path, path)
+
+    def _checkpoint_metadata(self, phase):
+        """Describes the alignment a checkpoint belongs to"""
+        return {
+            "size": self.size,
+            "tile_shape": list(self.tiles[0].shape[:2]),
+            "phase": phase,
+        }
+
+    def load_checkpoint(self, path, phase="align"):
+        """Restores the progress of align from a checkpoint
+
+        Features are only marked as detected if the tile can map them back
+        from its feature store, so tiles whose features were lost with the
+        previous process are detected again.
+
+        Parameters
+        ----------
+        path : str
+            path to the JSON file written by save_checkpoint
+        phase : str
+            what is being aligned, either "align" or "refine"
+
+        Returns
+        -------
+        tuple
+            tiles to align from next and tiles whose features were freed
+
+        Raises
+        ------
+        FileNotFoundError
+            thrown if there is no checkpoint
+        ValueError
+            thrown if JSON can't be decoded or does not match this mosaic
+        """
+        with open(path, "r", encoding="utf-8") as f:
+            checkpoint = json.load(f)
+
+        metadata = self._checkpoint_metadata(phase)
+        if checkpoint.get("metadata") != metadata:
+            raise ValueError(
+                f"Checkpoint does not match this mosaic"
+                f" ({checkpoint.get('metadata')} != {metadata})"
+            )
+
+        tiles = self.tiles
+        for tile in tiles:
+            tile.y = None
+            tile.x = None
+        for key, (y, x) in checkpoint["coords"].items():
+            tiles[int(key)].y = y
+            tiles[int(key)].x = x
+
+        cleared = [tiles[i] for i in checkpoint["cleared"]]
+        cleared_ids = {tile.id for tile in cleared}
+        for key, detected in checkpoint["features"].items():
+            tile = tiles[int(key)]
+            # Freed features are never needed again, since every neighbor is placed
+            if not detected or tile.id in cleared_ids or tile.features_stored:
+                tile.features_detected = detected
+
+        wavefront = [tiles[i] for i in checkpoint["wavefront"]]
+        logger.info(
+            f"Resumed {self} from {path} ({self.placed} tiles placed,"
+            f" {len(wavefront)} in wavefront)"
+        )
+        return wavefront, cleared
+
     # @profile
-    def align(self, origin=None, limit=None, batch_size = 10, **kwargs):
+    def align(
+        self,
+        origin=None,
+        limit=None,
+        batch_size = 10,
+        window=None,
+        checkpoint=None,
+        checkpoint_phase="align",
+        **kwargs,
+    ):
         """Builds a mosaic outward from a single tile using feature matching
 
         Parameters
@@ -1817,19 +2109,45 @@ class MemmapStructuredMosaic(MemmapMosaic):
             method finishes. If not given, the method will continue until
             it runs out of adjacent tiles with matching features. Setting
             a limit allows a decent mosaic to be created quickly.
+        window : float
+            if given, tiles with stage priors are seeded at the position
+            predicted by the priors and feature matching may only move them
+            this many pixels. Tiles that fail to match keep their predicted
+            position instead of being dropped.
+        checkpoint : str
+            if given, progress is saved to this path after each ring of tiles
+            and alignment resumes from it if it exists. See save_checkpoint.
+        checkpoint_phase : str
+            phase recorded in the checkpoint, so an interrupted refine is
+            never resumed as an align or the reverse
         kwargs :
             any keyword argument accepted by the align_to method on the
             Tiles comprising this mosaic
         """
 
-        # Align tiles outward from a single tile
-        tiles = [self._get_origin() if origin is None else origin]
-
-        # Set origin to 0, 0
-        if tiles[0].y is None:
-            tiles[0].y = 0
-        if tiles[0].x is None:
-            tiles[0].x = 0
+        tiles = None
+        cleared = {}
+        if checkpoint is not None:
+            try:
+                tiles, resumed = self.load_checkpoint(checkpoint, checkpoint_phase)
+                cleared = {t.id: t for t in resumed}
+            except FileNotFoundError:
+                pass
+            except (KeyError, TypeError, ValueError) as err:
+                logger.warning(f"Ignoring checkpoint {checkpoint}: {err}")
+
+        if tiles is None:
+            # Align tiles outward from a single tile
+            tiles = [self._get_origin() if origin is None else origin]
+
+            # Set origin to 0, 0
+            if tiles[0].y is None:
+                tiles[0].y = 0
+            if tiles[0].x is None:
+                tiles[0].x = 0
+
+        placed = self.placed
+        fallbacks = 0
 
         while tiles:
 
@@ -1847,8 +2165,7 @@ class MemmapStructuredMosaic(MemmapMosaic):
             
              # Control batch size
             batch = [t for t in unique.values() if not t.features_detected]
-            for i in range(0, len(batch), batch_size):
-                batch_slice = batch[i:i + batch_size]
+            for batch_slice in self._slices(batch, batch_size):
                 self._batch_tile_method("detect_and_extract", batch=batch_slice)
             
 
@@ -1860,24 +2177,35 @@ class MemmapStructuredMosaic(MemmapMosaic):
 
             # Control batch size
             batch = [(t, n) for t, n in unique.values() if not n.placed]
-            for i in range(0, len(batch), batch_size):
-                batch_slice = batch[i:i + batch_size]
-                self._batch_tile_method("align_to", [t for t, _ in batch_slice], batch=[n for _, n in batch_slice], **kwargs)
+            for batch_slice in self._slices(batch, batch_size):
+                self._batch_tile_method("align_to", [t for t, _ in batch_slice], batch=[n for _, n in batch_slice], window=window, **kwargs)
+
+            # Fall back to the stage-predicted position for tiles that could not be matched
+            if window is not None:
+                fallback = [(t, n) for t, n in batch if not n.placed and t.has_prior and n.has_prior]
+                for t, n in fallback:
+                    n.place_from_prior(t)
+                if fallback:
+                    logger.info(f"Placed {len(fallback)} tiles from stage priors")
+                fallbacks += len(fallback)
                 
 
             # Otherwise re-run the loop with the next group of tiles
             tiles = [n for _, n in batch if n.placed]
 
-            # If all of the neighbors are placed, delete the keypoints and descriptors to save memory
+            # If all of the neighbors are placed, delete the keypoints and descriptors to save memory. Tiles on
+            # the edge of the grid have fewer neighbors.
             for t, _ in batch:
-                neighbors = t.neighbors()
+                if t.id not in cleared and all(n.placed for n in t.neighbors().values()):
+                    t.clear_features()
+                    cleared[t.id] = t
 
-                if ("top" in neighbors and "left" in neighbors and "bottom" in neighbors and "right" in neighbors):
-                    if (neighbors["top"].placed and neighbors["left"].placed and neighbors["bottom"].placed and neighbors["right"].placed):
-                            # del t.descriptors
-                            # del t.keypoints 
-                            t.descriptors = np.array([0])
-                            t.keypoints = ()
+            # Move the features of placed tiles out of memory if over budget
+            if self.governor is not None and self.governor.under_pressure():
+                self.governor.relieve([t for t in self.tiles if t.placed])
+
+            if checkpoint is not None:
+                self.save_checkpoint(checkpoint, tiles, cleared.values(), checkpoint_phase)
 
         else:
             if limit is not None:
@@ -1886,6 +2214,267 @@ class MemmapStructuredMosaic(MemmapMosaic):
         if self.placed == 1 and len(self.tiles) > 1:
             raise RuntimeError("Could not align tiles")
 
+        # Tiles placed from priors sit at the raw stage positions, so a
+        # mosaic mostly placed that way is not aligned at all
+        if 2 * fallbacks > self.placed - placed:
+            logger.warning(
+                f"Placed {fallbacks} of {self.placed - placed} tiles from"
+                f" stage priors because they could not be matched"
+            )
+
+        logger.info(f"Aligned {self.placed} tiles in {self}")
+
+    def refine(self, window, **kwargs):
+        """Refines the current placement with a local search around each tile
+
+        Intended for placements loaded from a coarser resolution using
+        load_params. The loaded positions are used as priors, so tiles are
+        only matched within window pixels of them and keep their loaded
+        position if they can't be matched.
+
+        Parameters
+        ----------
+        window : float
+            maximum distance in pixels a tile can move from its loaded position
+        kwargs :
+            any keyword argument accepted by the align_to method on the
+            Tiles comprising this mosaic
+        """
+        for tile in self.tiles:
+            if tile.placed:
+                tile.prior_y = tile.y
+                tile.prior_x = tile.x
+            tile.y = None
+            tile.x = None
+
+        self.align(window=window, checkpoint_phase="refine", **kwargs)
+
+    def align_global(self, window=None, max_residual=5.0, prior_weight=0.01, **kwargs):
+        """Places all tiles at once from the offsets between every pair of neighbors
+
+        Unlike align, which grows the mosaic outward one ring at a time,
+        every horizontal and vertical pair of neighbors is matched in a
+        single parallel batch and the positions of all tiles are solved
+        together. See solve_positions.
+
+        Parameters
+        ----------
+        window : float
+            if given, pairs are matched within this many pixels of the offset
+            predicted by the stage priors, and pairs that could not be
+            matched are held near that offset with a low weight instead of
+            being left out
+        max_residual : float
+            maximum distance in pixels between the offset of a pair and the
+            solution before the pair is rejected
+        prior_weight : float
+            weight of a pair held at its stage-predicted offset relative to
+            a matched pair
+        kwargs :
+            any keyword argument accepted by the estimate_offset method on
+            the Tiles comprising this mosaic
+        """
+
+        batch = [t for t in self.tiles if not t.features_detected]
+        for batch_slice in self._slices(batch, len(batch)):
+            self._batch_tile_method("detect_and_extract", batch=batch_slice)
+
+        tiles = self.tiles
+        index = {t.id: i for i, t in enumerate(tiles)}
+        neighbors = []
+        for tile in tiles:
+            for direction, neighbor in tile.neighbors().items():
+                if direction in ("right", "bottom"):
+                    neighbors.append((neighbor, tile))
+
+        logger.info(
+            f"Matching {len(neighbors)} pairs of neighbors using {self.num_cores} cores"
+        )
+
+        def task(tile, other):
+            return tile.estimate_offset(other, window=window, **kwargs)
+
+        results = []
+        for batch_slice in self._slices(neighbors, len(neighbors)):
+            results.extend(self.pool(delayed(task)(t, o) for t, o in batch_slice))
+
+        pairs = []
+        offsets = []
+        weights = []
+        tolerances = []
+        for (tile, other), offset in zip(neighbors, results):
+            if offset is not None:
+                weight = 1.0
+                tolerance = max_residual
+            elif window is not None and tile.has_prior and other.has_prior:
+                offset = tile.expected_offset(other)
+                weight = prior_weight
+                tolerance = window
+            else:
+                continue
+            pairs.append((index[tile.id], index[other.id]))
+            offsets.append(offset)
+            weights.append(weight)
+            tolerances.append(tolerance)
+
+        matched = sum(1 for w in weights if w == 1.0)
+        logger.info(f"Matched {matched} of {len(neighbors)} pairs of neighbors")
+        if 2 * (len(weights) - matched) > len(neighbors):
+            logger.warning(
+                f"Held {len(weights) - matched} of {len(neighbors)} pairs of"
+                f" neighbors at their stage priors because they could not be"
+                f" matched"
+            )
+
+        positions, kept = solve_positions(
+            len(tiles), pairs, offsets, weights=weights, max_residual=tolerances
+        )
+        logger.info(f"Rejected {len(kept) - kept.sum()} of {len(kept)} pairs")
+
+        for tile, (y, x) in zip(tiles, positions):
+            tile.y = None if np.isnan(y) else float(y)
+            tile.x = None if np.isnan(x) else float(x)
+
+        if self.placed <= 1 and len(self.tiles) > 1:
+            raise RuntimeError("Could not align tiles")
+
+        logger.info(f"Aligned {self.placed} tiles in {self}")
+
+    def align_blocks(
+        self,
+        block_size=8,
+        overlap=1,
+        executor=None,
+        window=None,
+        max_residual=5.0,
+        prior_weight=0.01,
+        **kwargs,
+    ):
+        """Aligns overlapping blocks of the grid separately and merges them
+
+        The grid is split into square blocks of tiles that share overlap
+        rows and columns of tiles with their neighbors. Each block is aligned
+        with align in its own worker, then the offset of every block is
+        solved from the positions the blocks found for the tiles they share.
+        See split_blocks and align_block.
+
+        Parameters
+        ----------
+        block_size : int
+            number of rows and columns of tiles in a block
+        overlap : int
+            number of rows and columns of tiles shared by adjacent blocks
+        executor : concurrent.futures.Executor
+            runs the blocks. Any object with a submit method returning
+            futures works, so blocks can run on remote workers that can read
+            the tile files. Defaults to a local process pool with num_cores
+            workers.
+        window : float
+            passed to align for each block. If given, blocks that share no
+            placed tile are also held near the offset predicted by the stage
+            priors with a low weight.
+        max_residual : float
+            maximum distance in pixels between the positions two blocks
+            give a shared tile before the pair is rejected
+        prior_weight : float
+            weight of a pair of blocks held at its stage-predicted offset
+            relative to a shared tile
+        kwargs :
+            any keyword argument accepted by the align_to method on the
+            Tiles comprising this mosaic
+        """
+        tiles = self.tiles
+        index = {t.id: i for i, t in enumerate(tiles)}
+        blocks = split_blocks(self.shape, block_size, overlap)
+
+        # Send copies detached from the grid, so only the tiles in a block are pickled
+        jobs = []
+        for b, (rows, cols) in enumerate(blocks):
+            grid = []
+            for row in self.grid[rows]:
+                grid.append([])
+                for tile in row[cols]:
+                    tile = copy.copy(tile)
+                    tile.grid = None
+                    # Blocks free features when done with a tile, so shared
+                    # tiles keep separate copies unless features are cached.
+                    # Copies still delete their own entry when cleared.
+                    if tile.owns_features and tile.cache_key is None:
+                        tile.cache_key = f"{tile.id}_{b}"
+                    grid[-1].append(tile)
+            jobs.append(grid)
+
+        logger.info(f"Aligning {len(jobs)} blocks of {self}")
+        local = executor is None
+        if local:
+            executor = ProcessPoolExecutor(max_workers=self.num_cores)
+        try:
+            futures = [executor.submit(align_block, grid, window, **kwargs) for grid in jobs]
+            results = [future.result() for future in futures]
+        finally:
+            if local:
+                executor.shutdown()
+
+        # Positions of each tile in every block that placed it
+        found = defaultdict(list)
+        anchors = {}
+        for b, (grid, positions) in enumerate(zip(jobs, results)):
+            from_priors = []
+            for tile, position in zip(chain.from_iterable(grid), positions):
+                if position is not None:
+                    found[index[tile.id]].append((b, np.asarray(position)))
+                    if tile.has_prior:
+                        from_priors.append(np.subtract((tile.prior_y, tile.prior_x), position))
+            if from_priors:
+                anchors[b] = np.median(from_priors, axis=0)
+
+        # Block b sits at block a plus the difference between their positions for a shared tile
+        pairs = []
+        offsets = []
+        weights = []
+        tolerances = []
+        linked = set()
+        for entries in found.values():
+            for (a, pos_a), (b, pos_b) in zip(entries, entries[1:]):
+                pairs.append((b, a))
+                offsets.append(pos_a - pos_b)
+                weights.append(1.0)
+                tolerances.append(max_residual)
+                linked.add((a, b))
+
+        if window is not None:
+            for a, b in adjacent_blocks(blocks):
+                if (a, b) not in linked and a in anchors and b in anchors:
+                    pairs.append((b, a))
+                    offsets.append(anchors[b] - anchors[a])
+                    weights.append(prior_weight)
+                    tolerances.append(window)
+
+        if len(blocks) == 1:
+            offsets_solved = np.zeros((1, 2))
+        else:
+            offsets_solved, kept = solve_positions(
+                len(blocks), pairs, offsets, weights=weights, max_residual=tolerances
+            )
+            logger.info(f"Rejected {len(kept) - kept.sum()} of {len(kept)} pairs of blocks")
+
+        for i, tile in enumerate(tiles):
+            estimates = [
+                offsets_solved[b] + position
+                for b, position in found.get(i, [])
+                if not np.isnan(offsets_solved[b, 0])
+            ]
+            if estimates:
+                y, x = np.median(estimates, axis=0)
+                tile.y = float(y)
+                tile.x = float(x)
+            else:
+                tile.y = None
+                tile.x = None
+
+        if self.placed <= 1 and len(self.tiles) > 1:
+            raise RuntimeError("Could not align tiles")
+
         logger.info(f"Aligned {self.placed} tiles in {self}")
 
     def build_out(self, from_placed=True, offsets=None):
@@ -2241,9 +2830,458 @@ def is_grid(items):
 
     # Test if individual items are or can be made into tiles
     val = items[0][0]
-    if isinstance(val, (str, Tile)) or (
+    if isinstance(val, (str, Tile, MemmapTile)) or (
         isinstance(val, np.ndarray) and 2 <= len(val.shape) <= 3
     ):
         return True
 
     return False
+
+
+def solve_positions(size, pairs, offsets, weights=None, max_residual=5.0, max_iter=20):
+    """Solves for the positions that best agree with offsets between pairs
+
+    Each pair (i, j) with offset (dy, dx) asks for position i to sit at
+    position j + (dy, dx). All positions are solved at once as a sparse
+    weighted least-squares problem. Pairs that disagree with the solution
+    by more than their max_residual are rejected, worst first, and the
+    problem is solved again. Only positions connected to the largest group
+    of positions by the remaining pairs are returned.
+
+    Parameters
+    ----------
+    size : int
+        number of positions
+    pairs : list of tuple
+        indexes of each pair as (i, j)
+    offsets : list of tuple
+        offset of each pair as (dy, dx)
+    weights : list of float
+        weight of each pair. Defaults to 1 for every pair.
+    max_residual : float or list of float
+        maximum distance in pixels between the offset of a pair and the
+        solution, either for every pair or for each pair
+    max_iter : int
+        maximum number of times the problem is solved
+
+    Returns
+    -------
+    tuple
+        positions as an array of (y, x) with NaN for positions that could
+        not be solved, relative to the first solved position, and a boolean
+        array marking the pairs that were kept
+    """
+    positions = np.full((size, 2), np.nan)
+    pairs = np.asarray(pairs, dtype=int).reshape(-1, 2)
+    offsets = np.asarray(offsets, dtype=float).reshape(-1, 2)
+    weights = np.ones(len(pairs)) if weights is None else np.asarray(weights, dtype=float)
+    max_residual = np.broadcast_to(np.asarray(max_residual, dtype=float), (len(pairs),))
+    kept = np.ones(len(pairs), dtype=bool)
+
+    for _ in range(max_iter):
+        if not kept.any():
+            break
+
+        # Only solve the largest group of positions connected by the kept pairs
+        i, j = pairs[kept].T
+        graph = coo_matrix((np.ones(len(i)), (i, j)), shape=(size, size))
+        _, labels = connected_components(graph, directed=False)
+        largest = np.bincount(labels).argmax()
+        nodes = np.flatnonzero(labels == largest)
+        column = np.full(size, -1)
+        column[nodes] = np.arange(len(nodes))
+
+        use = kept & (labels[pairs[:, 0]] == largest)
+        rows = np.flatnonzero(use)
+        sqrt_w = np.sqrt(weights[rows])
+
+        # One row per pair plus one pinning the first position to the origin
+        n = len(rows)
+        data = np.concatenate([sqrt_w, -sqrt_w, [1.0]])
+        row_idx = np.concatenate([np.arange(n), np.arange(n), [n]])
+        col_idx = np.concatenate([column[pairs[rows, 0]], column[pairs[rows, 1]], [0]])
+        a = coo_matrix((data, (row_idx, col_idx)), shape=(n + 1, len(nodes))).tocsr()
+
+        solved = np.zeros((len(nodes), 2))
+        for axis in range(2):
+            b = np.concatenate([sqrt_w * offsets[rows, axis], [0.0]])
+            solved[:, axis] = lsqr(a, b, atol=1e-10, btol=1e-10)[0]
+
+        positions[:] = np.nan
+        positions[nodes] = solved
+
+        # Reject the pairs that disagree most with the solution and solve again
+        residuals = np.zeros(len(pairs))
+        predicted = positions[pairs[rows, 0]] - positions[pairs[rows, 1]]
+        residuals[rows] = np.abs(predicted - offsets[rows]).max(axis=1)
+        excess = residuals / max_residual
+        if excess.max() <= 1:
+            break
+        kept &= ~(excess > max(1, 0.9 * excess.max()))
+
+    return positions, kept
+
+
+def match_partners(candidates, tiles, placed, tried, count=4, shortlists=None):
+    """Chooses the placed tiles each candidate is matched against
+
+    Candidates with stage priors are matched against the placed tiles their
+    priors put closest to them, up to count tiles that could overlap them.
+    Candidates without priors are matched against the placed tiles on their
+    shortlist, or against every newly placed tile if no shortlists are
+    given, which makes alignment quadratic in the number of tiles. Pairs
+    already compared are skipped, so each pair is matched at most once.
+
+    Parameters
+    ----------
+    candidates : list of Tile
+        tiles that have not been placed
+    tiles : list of Tile
+        tiles placed since the last round of matching
+    placed : list of Tile
+        all placed tiles
+    tried : set
+        ids of the pairs already compared as (candidate id, placed id).
+        Updated with the pairs returned.
+    count : int
+        maximum number of placed tiles chosen for a candidate in a round
+    shortlists : dict
+        ids of the tiles worth matching against each tile, most promising
+        first, keyed by tile id. See tile_shortlists.
+
+    Returns
+    -------
+    dict
+        placed tiles to match against, nearest first, keyed by candidate id
+    """
+    with_prior = [t for t in placed if getattr(t, "has_prior", False)]
+    if with_prior:
+        prior_yx = np.array([(t.prior_y, t.prior_x) for t in with_prior], dtype=float)
+    if shortlists:
+        by_id = {t.id: t for t in placed}
+
+    partners = {}
+    for tile in candidates:
+        if with_prior and getattr(tile, "has_prior", False):
+            dist = np.abs(prior_yx - (tile.prior_y, tile.prior_x))
+            overlaps = (dist[:, 0] < tile.height) & (dist[:, 1] < tile.width)
+            order = [i for i in np.argsort(dist.sum(axis=1)) if overlaps[i]]
+            others = [with_prior[i] for i in order]
+        elif shortlists:
+            others = [by_id[i] for i in shortlists.get(tile.id, []) if i in by_id]
+        else:
+            others = tiles
+
+        chosen = []
+        for other in others:
+            if (tile.id, other.id) not in tried:
+                chosen.append(other)
+                if others is not tiles and len(chosen) >= count:
+                    break
+        tried.update((tile.id, other.id) for other in chosen)
+        partners[tile.id] = chosen
+
+    return partners
+
+
+def tile_shortlists(tiles, count=4):
+    """Lists the tiles whose features most resemble those of each tile
+
+    Each tile is summarized by the mean of its descriptors, with binary
+    descriptors unpacked to bits, centered on the mean over all tiles. Tiles
+    that overlap share features, so they tend to have similar summaries.
+    The shortlist of a tile holds the count tiles most similar to it, plus
+    any tile whose own shortlist holds it, so matching along the shortlists
+    compares a number of pairs linear in the number of tiles.
+
+    Parameters
+    ----------
+    tiles : list of Tile
+        tiles with detected features
+    count : int
+        number of most similar tiles kept for each tile
+
+    Returns
+    -------
+    dict
+        ids of the tiles on the shortlist of each tile, most similar first,
+        keyed by tile id
+    """
+    ids = []
+    means = []
+    for tile in tiles:
+        descriptors = tile.descriptors
+        if descriptors is None or not len(descriptors):
+            continue
+        if descriptors.dtype == np.uint8:
+            descriptors = np.unpackbits(descriptors, axis=1)
+        ids.append(tile.id)
+        means.append(np.mean(descriptors, axis=0, dtype=np.float64))
+    if len(ids) < 2:
+        return {}
+
+    signatures = np.array(means)
+    signatures -= signatures.mean(axis=0)
+    norms = np.linalg.norm(signatures, axis=1)
+    signatures /= np.where(norms > 0, norms, 1)[:, None]
+
+    # Similarities are computed a chunk of rows at a time to bound memory
+    count = min(count, len(ids) - 1)
+    shortlists = {}
+    for start in range(0, len(ids), 1024):
+        similarity = signatures[start:start + 1024] @ signatures.T
+        for row, i in enumerate(range(start, min(start + 1024, len(ids)))):
+            similarity[row, i] = -np.inf
+            nearest = np.argpartition(-similarity[row], count - 1)[:count]
+            nearest = nearest[np.argsort(-similarity[row, nearest])]
+            shortlists[ids[i]] = [ids[j] for j in nearest]
+
+    for tile_id, others in list(shortlists.items()):
+        for other_id in others:
+            if tile_id not in shortlists[other_id]:
+                shortlists[other_id].append(tile_id)
+    return shortlists
+
+
+def solve_gains(size, stats, sigma_n=10.0, sigma_g=0.1):
+    """Solves for the gains that best equalize overlapping tiles
+
+    Minimizes the difference between the gain-adjusted means of each
+    overlap, weighted by the number of pixels sampled, plus a prior that
+    keeps gains near 1 so the overall brightness is preserved. Each channel
+    is solved separately as a sparse linear system. See Brown and Lowe,
+    Automatic Panoramic Image Stitching using Invariant Features (2007).
+
+    Parameters
+    ----------
+    size : int
+        number of tiles
+    stats : list of tuple
+        statistics of each overlap as (i, j, mean_i, mean_j, count), where
+        mean_i and mean_j are the mean of each channel in tiles i and j
+    sigma_n : float
+        expected noise in the mean intensity of an overlap
+    sigma_g : float
+        expected spread of the gains around 1
+
+    Returns
+    -------
+    numpy.ndarray
+        gain of each tile as an array of shape (size, channels)
+    """
+    if not stats:
+        return np.ones((size, 1))
+
+    channels = len(np.atleast_1d(stats[0][2]))
+    gains = np.ones((size, channels))
+    for c in range(channels):
+        rows, cols, vals = [], [], []
+        b = np.zeros(size)
+        for i, j, mean_i, mean_j, count in stats:
+            mi = np.atleast_1d(mean_i)[c]
+            mj = np.atleast_1d(mean_j)[c]
+            # The error sums over both orderings of each pair, so the
+            # overlap term appears twice in the derivative for each gain
+            # while the prior on the gain appears once
+            for a, ma, o, mo in ((i, mi, j, mj), (j, mj, i, mi)):
+                rows.extend([a, a])
+                cols.extend([a, o])
+                vals.extend(
+                    [
+                        2 * count * ma ** 2 / sigma_n ** 2 + count / sigma_g ** 2,
+                        -2 * count * ma * mo / sigma_n ** 2,
+                    ]
+                )
+                b[a] += count / sigma_g ** 2
+
+        # Tiles without overlaps keep a gain of 1
+        isolated = np.flatnonzero(b == 0)
+        rows.extend(isolated)
+        cols.extend(isolated)
+        vals.extend([1.0] * len(isolated))
+        b[isolated] = 1
+
+        matrix = coo_matrix((vals, (rows, cols)), shape=(size, size)).tocsr()
+        gains[:, c] = spsolve(matrix, b)
+
+    return gains
+
+
+def split_blocks(shape, block_size, overlap=1):
+    """Splits a grid into overlapping blocks
+
+    Parameters
+    ----------
+    shape : tuple
+        number of rows and columns in the grid
+    block_size : int
+        number of rows and columns in a block
+    overlap : int
+        number of rows and columns shared by adjacent blocks
+
+    Returns
+    -------
+    list of tuple
+        rows and columns of each block as a pair of slices
+    """
+    stride = max(block_size - overlap, 1)
+
+    def starts(n):
+        return range(0, max(n - overlap, 1), stride)
+
+    return [
+        (slice(r, min(r + block_size, shape[0])), slice(c, min(c + block_size, shape[1])))
+        for r in starts(shape[0])
+        for c in starts(shape[1])
+    ]
+
+
+def adjacent_blocks(blocks):
+    """Finds the pairs of blocks that share tiles
+
+    Parameters
+    ----------
+    blocks : list of tuple
+        rows and columns of each block as a pair of slices. See split_blocks.
+
+    Returns
+    -------
+    list of tuple
+        indexes of each pair of blocks as (a, b) with a < b
+    """
+    def shares(a, b):
+        return a.start < b.stop and b.start < a.stop
+
+    return [
+        (a, b)
+        for a in range(len(blocks))
+        for b in range(a + 1, len(blocks))
+        if shares(blocks[a][0], blocks[b][0]) and shares(blocks[a][1], blocks[b][1])
+    ]
+
+
+def align_block(grid, window=None, **kwargs):
+    """Aligns a block of tiles, typically in a worker process
+
+    Parameters
+    ----------
+    grid : list of list
+        tiles in the block, detached from the full grid
+    window : float
+        passed to MemmapStructuredMosaic.align
+    kwargs :
+        any keyword argument accepted by the align_to method on the tiles
+
+    Returns
+    -------
+    list
+        position of each tile in the block in row order as (y, x) relative
+        to the block, or None if the tile was not placed
+    """
+    mosaic = MemmapStructuredMosaic(grid)
+    try:
+        mosaic.align(window=window, **kwargs)
+    except RuntimeError:
+        # Tiles that were placed are still merged if they are shared
+        pass
+    return [(t.y, t.x) if t.placed else None for t in mosaic.tiles]
+
+
+class SpatialIndex:
+    """Finds placed tiles by position using a uniform grid hash
+
+    Each tile is stored in every cell of a regular grid that its bounds
+    cover. A query only tests the tiles in the cells it covers, so finding
+    the neighbors of a tile takes roughly constant time however many tiles
+    are indexed. Only bounds are compared, so no image data is read.
+
+    Attributes
+    ----------
+    cell_size : float
+        size of a cell in pixels
+    """
+
+    def __init__(self, tiles=(), cell_size=None):
+        """Initializes an index of placed tiles
+
+        Parameters
+        ----------
+        tiles : list of Tile
+            placed tiles to add to the index
+        cell_size : float
+            size of a cell in pixels. Defaults to the larger side of the
+            first tile, so a tile covers at most four cells.
+        """
+        tiles = list(tiles)
+        if cell_size is None:
+            cell_size = max(tiles[0].height, tiles[0].width) if tiles else 1
+        self.cell_size = cell_size
+        self._cells = defaultdict(dict)
+        self._bounds = {}
+        for tile in tiles:
+            self.insert(tile)
+
+    def __len__(self):
+        return len(self._bounds)
+
+    def _cells_covering(self, bounds):
+        y1, x1, y2, x2 = bounds
+        size = self.cell_size
+        for cy in range(int(np.floor(y1 / size)), int(np.floor(y2 / size)) + 1):
+            for cx in range(int(np.floor(x1 / size)), int(np.floor(x2 / size)) + 1):
+                yield cy, cx
+
+    def insert(self, tile):
+        """Adds a placed tile at its current bounds
+
+        Parameters
+        ----------
+        tile : Tile
+            a placed tile. Tiles that move must be removed and inserted
+            again.
+        """
+        self.remove(tile)
+        bounds = tile.bounds()
+        self._bounds[tile.id] = bounds
+        for cell in self._cells_covering(bounds):
+            self._cells[cell][tile.id] = tile
+
+    def remove(self, tile):
+        """Removes a tile if it is in the index
+
+        Parameters
+        ----------
+        tile : Tile
+            tile to remove
+        """
+        bounds = self._bounds.pop(tile.id, None)
+        if bounds is not None:
+            for cell in self._cells_covering(bounds):
+                self._cells[cell].pop(tile.id, None)
+
+    def query(self, bounds):
+        """Finds the tiles that overlap the given bounds
+
+        Parameters
+        ----------
+        bounds : tuple
+            bounds in the mosaic coordinate system as (y1, x1, y2, x2)
+
+        Returns
+        -------
+        list of tuple
+            each overlapping tile and the area of its overlap in pixels,
+            in the order the tiles were found
+        """
+        y1, x1, y2, x2 = bounds
+        found = {}
+        for cell in self._cells_covering(bounds):
+            for tile_id, tile in self._cells.get(cell, {}).items():
+                if tile_id in found:
+                    continue
+                ty1, tx1, ty2, tx2 = self._bounds[tile_id]
+                height = min(y2, ty2) - max(y1, ty1)
+                width = min(x2, tx2) - max(x1, tx1)
+                if height > 0 and width > 0:
+                    found[tile_id] = (tile, height * width)
+        return list(found.values())
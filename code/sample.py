@@ -288,6 +288,33 @@ class Sample:
 
         return top_half_targets, bot_half_targets
 
+    def frame_coordinates(self):
+        """Pairs the recorded gantry coordinates with the row and column of the frame captured there.
+
+        Coordinates are appended in capture order, which is the serpentine order of the targets for cookies and
+        the frame index for cores captured with capture_core_bottom. Frames without a recorded coordinate are
+        left out.
+
+        Returns:
+            dict: (row, col) of each frame mapped to the X, Y, Z coordinates of the gantry
+        """
+        if self.is_core:
+            return {(i, 0): tuple(c) for i, c in enumerate(self.coordinates)}
+
+        targets = np.vstack((self.targets_top, self.targets_bot))
+        return {(int(t[3]), int(t[4])): tuple(c) for t, c in zip(targets, self.coordinates)}
+
+    def background_frames(self):
+        """Finds the frames flagged as background while focusing.
+
+        Flags are appended in capture order, the same order as the coordinates, so they are paired with frames the
+        same way as in frame_coordinates.
+
+        Returns:
+            set: (row, col) of each frame flagged as background
+        """
+        return {key for key, flag in zip(self.frame_coordinates(), self.background) if flag}
+
     def get_center_location(self):
         """Retrieve the center location of the sample
 
@@ -2,18 +2,25 @@
 
 import tile as tile_memmap
 import mosaic as mosaic_memmap
-import rasterio
+import features
+import memory
 import tifffile
 import numpy as np
+import cv2
+from joblib import Parallel, delayed
+import hashlib
 import json
 import re
 import os
 from datetime import datetime
 import glob
+import shutil
 import gc
-import imutils
 import logging as log
 import sample
+import queue
+import multiprocessing
+from threading import Thread
 # from memory_profiler import profile
 import sys 
 import time
@@ -22,6 +29,24 @@ import math
 
 log.basicConfig(format='%(process)d-%(levelname)s-%(message)s', level=log.INFO)
 
+# Placement of the tiles at full scale, cached in the sample directory and shared by every stitch size
+ALIGNMENT_PARAMS = "alignment_params.json"
+
+# Progress of an alignment in the sample directory, so a stitch that is killed resumes where it stopped
+ALIGNMENT_CHECKPOINT = "alignment_checkpoint.json"
+
+# Flat-field profiles, cached next to the sample directories and shared by every sample captured at the same zoom
+FLAT_FIELDS = "flat_fields"
+
+# Fewest frames with tissue a flat-field profile is estimated from, so the tissue in each drops out of the median
+FLAT_FIELD_MIN_FRAMES = 8
+
+# Tile classes that can be chosen with the ALIGNER config key
+ALIGNERS = {
+    "features": tile_memmap.MemmapOpenCVTile,
+    "phase_correlation": tile_memmap.MemmapPhaseCorrelationTile,
+}
+
 class MaxFileSizeException(Exception):
     "Raised when a file is created that is over the maximum file size"
     def __init__(self, size):
@@ -29,6 +54,567 @@ class MaxFileSizeException(Exception):
         message = "File over {} MB created"
         super().__init__(message)
 
+def read_frame(path):
+    """Reads a captured frame, as a read-only memmap of its pixel strips if the TIFF is uncompressed.
+
+    Args:
+        path (str): Path to the frame
+
+    Returns:
+        numpy.ndarray: Frame data with shape (height, width, channels)
+    """
+    with tifffile.TiffFile(path) as tif:
+        page = tif.pages[0]
+        if page.is_memmappable:
+            return np.memmap(path, dtype=page.dtype, mode='r', offset=page.dataoffsets[0], shape=page.shape)
+        return page.asarray()
+
+def resize_frame(data, resize):
+    """Resizes frame data to a fraction of its width with area interpolation, as done when writing dats.
+
+    Args:
+        data (numpy.ndarray): Frame data with shape (height, width, channels)
+        resize (float): Fraction of the original width to resize the frame to
+
+    Returns:
+        numpy.ndarray: Resized frame data
+    """
+    width = int(resize * data.shape[1])
+    height = int(data.shape[0] * width / float(data.shape[1]))
+    return cv2.resize(np.asarray(data), (width, height), interpolation=cv2.INTER_AREA)
+
+def ingest_frame(frame_path, memmap_path, resize, flat_field=None):
+    """Decodes a single frame, resizes it with area interpolation and writes it to a .dat file.
+
+    Args:
+        frame_path (str): Path to the captured frame
+        memmap_path (str): Path of the .dat file to write
+        resize (float): Fraction of the original width to resize the frame to
+        flat_field (numpy.ndarray, optional): Correction with the shape of the resized frame that it is multiplied
+            by. See flat_field_correction. Defaults to None.
+
+    Returns:
+        tuple: Shape and dtype of the written data and the number of bytes decoded
+    """
+    data = read_frame(frame_path)
+    resized = resize_frame(data, resize)
+    if flat_field is not None:
+        resized = cv2.multiply(resized, flat_field, dtype=cv2.CV_8U)
+
+    memmap_array = np.memmap(memmap_path, dtype=resized.dtype, mode='w+', shape=resized.shape)
+    memmap_array[:] = resized[:]
+    memmap_array.flush()
+    del memmap_array
+
+    return resized.shape, resized.dtype, data.nbytes
+
+def estimate_flat_field(frame_paths, width=64, degree=4, workers=4):
+    """Estimates the illumination profile shared by the frames of a capture.
+
+    Each frame is reduced to a small thumbnail and the per-pixel median over the thumbnails is taken, so tissue
+    that differs from frame to frame mostly drops out. A smooth polynomial surface is then fitted to the median of
+    each channel to remove what is left of the tissue, keeping the falloff of the light. The profile is normalized
+    to a mean of 1 in each channel.
+
+    Args:
+        frame_paths (list): Paths of the frames to estimate the profile from, without background frames
+        width (int, optional): Width of the thumbnails and profile. Defaults to 64.
+        degree (int, optional): Degree of the polynomial surface fitted to the median. Defaults to 4.
+        workers (int, optional): Number of threads reading frames. Defaults to 4.
+
+    Returns:
+        numpy.ndarray: float32 profile with shape (height, width, channels)
+    """
+    def thumbnail(frame_path):
+        data = read_frame(frame_path)
+        return resize_frame(data, width / data.shape[1]).astype(np.float32)
+
+    pool = Parallel(n_jobs=workers, prefer="threads", pre_dispatch="n_jobs")
+    thumbnails = pool(delayed(thumbnail)(frame_path) for frame_path in frame_paths)
+    median = np.median(thumbnails, axis=0)
+    median = median.reshape(median.shape[0], median.shape[1], -1)
+
+    # Fit on coordinates in [-1, 1] so the terms are well conditioned
+    height, width = median.shape[:2]
+    y, x = np.mgrid[0:height, 0:width]
+    y = (y + 0.5) / height * 2 - 1
+    x = (x + 0.5) / width * 2 - 1
+    terms = np.stack([(x ** i * y ** j).ravel() for i in range(degree + 1) for j in range(degree + 1 - i)], axis=1)
+    coefficients = np.linalg.lstsq(terms, median.reshape(height * width, -1), rcond=None)[0]
+    profile = (terms @ coefficients).reshape(median.shape)
+
+    return (profile / np.maximum(profile.mean(axis=(0, 1)), 1e-6)).astype(np.float32)
+
+def flat_field_path(sample, frame_shape):
+    """Gets the path of the flat-field profile shared by samples captured with the same field of view and camera.
+
+    Args:
+        sample (sample.Sample): Sample the frames belong to
+        frame_shape (tuple): Shape of the captured frames as (height, width[, channels])
+
+    Returns:
+        str: Path of the profile in the FLAT_FIELDS directory next to the sample directory
+    """
+    name = "fov_{:.3f}x{:.3f}mm_{}x{}px.npy".format(
+        sample.image_width_mm, sample.image_height_mm, frame_shape[1], frame_shape[0])
+    return os.path.join(os.path.dirname(os.path.normpath(sample.directory)), FLAT_FIELDS, name)
+
+def flat_field_digest(profile):
+    """Hashes a flat-field profile, so features and placements record the correction of the frames they came from.
+
+    Args:
+        profile (numpy.ndarray): Profile from estimate_flat_field, or None if frames are not corrected
+
+    Returns:
+        str: SHA-1 hex digest of the profile, or None if there is no profile
+    """
+    if profile is None:
+        return None
+    return hashlib.sha1(np.ascontiguousarray(profile).tobytes()).hexdigest()
+
+def save_flat_field(profile, profile_path):
+    """Saves a flat-field profile under a temporary name first, so a stitch or capture never reads a partial one.
+
+    Args:
+        profile (numpy.ndarray): Profile from estimate_flat_field
+        profile_path (str): Path of the profile, see flat_field_path
+    """
+    os.makedirs(os.path.dirname(profile_path), exist_ok=True)
+    tmp_path = "{}.{}.tmp.npy".format(profile_path[:-len(".npy")], os.getpid())
+    np.save(tmp_path, profile)
+    os.replace(tmp_path, profile_path)
+
+def flat_field_correction(profile, shape, min_gain=0.2):
+    """Scales a flat-field profile to a frame shape and inverts it into the factor frames are multiplied by.
+
+    Args:
+        profile (numpy.ndarray): Profile from estimate_flat_field
+        shape (tuple): Shape of the frames to correct as (height, width, channels)
+        min_gain (float, optional): Smallest profile value used, so dark corners are not amplified without bound.
+            Defaults to 0.2.
+
+    Returns:
+        numpy.ndarray: float32 correction with the given shape
+    """
+    scaled = cv2.resize(profile, (shape[1], shape[0]), interpolation=cv2.INTER_CUBIC).reshape(shape)
+    return (1 / np.maximum(scaled, min_gain)).astype(np.float32)
+
+def make_plane(data, scale=1.0):
+    """Makes a single-channel copy of tile data, optionally downscaled, used for alignment.
+
+    Args:
+        data (numpy.ndarray): Tile data with shape (height, width[, channels])
+        scale (float, optional): Size of the plane relative to the tile data. Defaults to 1.0.
+
+    Returns:
+        numpy.ndarray: Plane with shape (height, width)
+    """
+    # Same conversion SIFT applies internally to color images
+    plane = cv2.cvtColor(np.asarray(data), cv2.COLOR_BGR2GRAY) if data.ndim == 3 else np.asarray(data)
+    if scale != 1.0:
+        width = int(scale * plane.shape[1])
+        height = int(plane.shape[0] * width / float(plane.shape[1]))
+        plane = cv2.resize(plane, (width, height), interpolation=cv2.INTER_AREA)
+    return plane
+
+def write_plane(data, plane_path, scale=1.0, flat_field=None):
+    """Writes a single-channel copy of tile data, optionally downscaled, to a .dat file used for alignment.
+
+    Args:
+        data (numpy.ndarray): Tile data with shape (height, width[, channels])
+        plane_path (str): Path of the .dat file to write
+        scale (float, optional): Size of the plane relative to the tile data. Defaults to 1.0.
+        flat_field (numpy.ndarray, optional): Correction with the shape of the tile data that it is multiplied by
+            first. See flat_field_correction. Defaults to None.
+
+    Returns:
+        tuple: Shape of the written plane
+    """
+    if flat_field is not None:
+        data = cv2.multiply(np.asarray(data), flat_field, dtype=cv2.CV_8U)
+    plane = make_plane(data, scale)
+
+    memmap_array = np.memmap(plane_path, dtype=plane.dtype, mode='w+', shape=plane.shape)
+    memmap_array[:] = plane[:]
+    memmap_array.flush()
+    del memmap_array
+
+    return plane.shape
+
+def frames_digest(frame_dir):
+    """Hashes the names, sizes and modification times of the frames in a directory.
+
+    Args:
+        frame_dir (str): Directory containing frame_{row}_{col}*.tiff files
+
+    Returns:
+        str: SHA-1 hex digest, which changes if frames are added, removed or captured again
+    """
+    pattern = re.compile(r'frame_(-?\d+)_(-?\d+)')
+    entries = []
+    for name in sorted(f for f in os.listdir(frame_dir) if pattern.match(f)):
+        stat = os.stat(os.path.join(frame_dir, name))
+        entries.append([name, stat.st_size, stat.st_mtime_ns])
+    return hashlib.sha1(json.dumps(entries).encode("utf-8")).hexdigest()
+
+def alignment_settings(frame_dir, aligner, detector, mode, alignment_size, flat_field=None):
+    """Collects the settings a placement depends on, saved with ALIGNMENT_PARAMS and checked when it is reused.
+
+    Args:
+        frame_dir (str): Directory containing the frames
+        aligner (str): Name of the aligner, see ALIGNERS
+        detector (str): Name of the feature detector
+        mode (str): Alignment mode
+        alignment_size (float): Size the placement is aligned at when reused across sizes
+        flat_field (str, optional): Digest of the flat-field profile the frames were corrected with, see
+            flat_field_digest. Defaults to None, for uncorrected frames.
+
+    Returns:
+        dict: Settings to store in the params metadata
+    """
+    return {
+        "aligner": aligner,
+        "detector": detector,
+        "alignment_mode": mode,
+        "alignment_size": alignment_size,
+        "flat_field": flat_field,
+        "frames": frames_digest(frame_dir),
+    }
+
+def feature_cache_key(cache, frame_path, tile, flat_field=None):
+    """Builds the key of the features of a tile in a feature cache.
+
+    The key covers everything that changes the features found: the frame content, the flat-field correction of
+    the data they were detected in, the detector, the size of the tile and its plane and the regions searched.
+
+    Args:
+        cache (features.FeatureCache): Cache the key is for
+        frame_path (str): Path to the frame the tile was made from
+        tile (tile.MemmapOpenCVTile): Tile with its grid, overlap, scale and plane scale set
+        flat_field (str, optional): Digest of the flat-field profile the data features are detected in was
+            corrected with, see flat_field_digest. Defaults to None, for uncorrected data.
+
+    Returns:
+        str: Key of the features
+    """
+    return cache.key(
+        cache.frame_hash(frame_path),
+        flat_field=flat_field,
+        detector=tile._detector,
+        scale=round(tile.scale, 6),
+        plane_scale=round(tile.plane_scale, 6),
+        regions=[[int(v) for v in region] for region in tile.overlap_regions()],
+    )
+
+class FeatureCacheFiller:
+    """Detects features of frames as they are captured and stores them in the feature cache of the sample, so the
+    first stitch finds them already computed. Runs on a single background thread that uses the CPU left idle while
+    the gantry moves.
+    """
+    def __init__(self, sample: sample.Sample, resize):
+        """
+        Args:
+            sample (sample.Sample): Sample being captured
+            resize (float): First size the sample will be stitched at. Features are detected at the size that
+                stitch aligns at.
+        """
+        config = utils.load_config()
+        self.sample = sample
+        self._cache = features.FeatureCache(os.path.join(sample.directory, "feature_cache"))
+        self._detector = config["stitcher"]["DETECTOR"]
+        self._use_planes = config["stitcher"]["ALIGNMENT_PLANES"]
+        self._plane_scale = config["stitcher"]["ALIGNMENT_PLANE_SCALE"]
+        self._overlap = sample.percent_overlap / 100 if config["stitcher"]["DETECT_IN_OVERLAP"] else None
+        if config["stitcher"]["REUSE_ALIGNMENT"] and config["stitcher"]["ALIGNMENT_SIZE"] < resize:
+            resize = config["stitcher"]["ALIGNMENT_SIZE"]
+        self._resize = resize
+        # Frames are corrected with the profile shared by the zoom, estimated from the first frames if there is none
+        self._flat_field_frames = config["stitcher"]["FLAT_FIELD_FRAMES"]
+        self._flat_field_profile = None
+        self._flat_field_loaded = not config["stitcher"]["FLAT_FIELD"]
+        self._flat_field_corrections = {}
+        self._pending = []
+        self._queue = queue.Queue()
+        self._worker = None
+
+    def start(self):
+        self._worker = Thread(target=self._run, daemon=True)
+        self._worker.start()
+
+    def add(self, frame_path):
+        """Queues a captured frame for detection.
+
+        Args:
+            frame_path (str): Path to the frame, named frame_{row}_{col}_{stack}.tiff
+        """
+        self._queue.put(frame_path)
+
+    def stop(self, wait=True):
+        """Stops the filler once the queued frames are done.
+
+        Args:
+            wait (bool, optional): Wait for the queued frames. Otherwise the thread finishes them in the background.
+                Defaults to True.
+        """
+        self._queue.put(None)
+        if wait and self._worker is not None:
+            self._worker.join()
+
+    def _run(self):
+        while True:
+            frame_path = self._queue.get()
+            for ready_path in self.ready(frame_path):
+                try:
+                    self.fill(ready_path)
+                except Exception as e:
+                    # A missed frame is detected again when stitching
+                    log.info("Could not cache features of {}: {}".format(ready_path, e))
+            if frame_path is None:
+                break
+
+    def ready(self, frame_path):
+        """Holds frames back until the flat-field profile is known, so every frame is detected with the correction
+        the stitch will use.
+
+        Args:
+            frame_path (str): Path to the captured frame, or None once capture has stopped
+
+        Returns:
+            list: Paths of the frames ready for detection
+        """
+        if self._flat_field_loaded:
+            return [] if frame_path is None else [frame_path]
+
+        if frame_path is not None:
+            self._pending.append(frame_path)
+            # An earlier sample at the same zoom may already have a profile
+            settled = len(self._pending) == 1 and self.load_flat_field()
+            if not settled and len(self._pending) < self._flat_field_frames:
+                return []
+
+        if self._pending and not self._flat_field_loaded:
+            self.load_flat_field(estimate=True)
+        pending, self._pending = self._pending, []
+        return pending
+
+    def fill(self, frame_path):
+        """Detects the features of a frame and stores them in the cache under the key the stitcher will look up.
+
+        Args:
+            frame_path (str): Path to the frame, named frame_{row}_{col}_{stack}.tiff
+
+        Returns:
+            tile.MemmapOpenCVTile: Tile of the frame at its place in the grid, with its features in the cache
+        """
+        match = re.match(r'frame_(-?\d+)_(-?\d+)', os.path.basename(frame_path))
+        data = read_frame(frame_path)
+        frame_width = data.shape[1]
+        if self._resize < 1.0:
+            data = resize_frame(data, self._resize)
+        if self._flat_field_profile is not None:
+            if data.shape not in self._flat_field_corrections:
+                self._flat_field_corrections[data.shape] = flat_field_correction(self._flat_field_profile, data.shape)
+            data = cv2.multiply(np.asarray(data), self._flat_field_corrections[data.shape], dtype=cv2.CV_8U)
+        plane = make_plane(data, self._plane_scale if self._use_planes else 1.0)
+
+        # Frames are sorted top row first in the mosaic grid (see Stitcher.get_frames)
+        rows, cols = self.sample.rows, self.sample.cols
+        tile = tile_memmap.MemmapOpenCVTile(frame_path, data.shape, detector=self._detector)
+        tile.row = rows - 1 - int(match.group(1))
+        tile.col = int(match.group(2))
+        tile.grid = [[None] * cols for _ in range(rows)]
+        tile.overlap = self._overlap
+        tile.scale = data.shape[1] / frame_width
+        tile.plane_scale = plane.shape[1] / data.shape[1]
+        tile.feature_store = self._cache
+        tile.cache_key = feature_cache_key(
+            self._cache, frame_path, tile, flat_field_digest(self._flat_field_profile))
+
+        if not tile.features_stored:
+            tile.set_features(*tile._detect_in_regions(plane, tile.overlap_regions(), tile.plane_scale))
+        return tile
+
+    def load_flat_field(self, estimate=False):
+        """Loads the flat-field profile shared by the zoom of the sample, or estimates and saves it from the frames
+        held back, as Stitcher.flat_field_correction would, so the stitch finds the same profile.
+
+        Args:
+            estimate (bool, optional): Estimate the profile if there is none. Defaults to False.
+
+        Returns:
+            bool: Whether the profile is settled, including when there are too few frames to estimate it from
+        """
+        with tifffile.TiffFile(self._pending[0]) as tif:
+            profile_path = flat_field_path(self.sample, tif.pages[0].shape)
+
+        if os.path.exists(profile_path):
+            self._flat_field_profile = np.load(profile_path)
+        elif estimate:
+            pattern = re.compile(r'frame_(-?\d+)_(-?\d+)')
+            background = self.sample.background_frames()
+            frame_paths = [
+                frame_path for frame_path in self._pending
+                if tuple(int(g) for g in pattern.match(os.path.basename(frame_path)).groups()) not in background]
+            if len(frame_paths) < FLAT_FIELD_MIN_FRAMES:
+                log.info("Caching features of uncorrected frames, only {} frames with tissue for the flat field".format(
+                    len(frame_paths)))
+            else:
+                self._flat_field_profile = estimate_flat_field(frame_paths, workers=1)
+                save_flat_field(self._flat_field_profile, profile_path)
+                log.info("Estimated flat field from the first {} frames captured".format(len(frame_paths)))
+        else:
+            return False
+
+        self._flat_field_loaded = True
+        return True
+
+class IncrementalAligner(FeatureCacheFiller):
+    """Aligns frames as they are captured, so only drawing the mosaic is left when the capture ends.
+
+    Each frame is detected as by FeatureCacheFiller and matched against the neighbors captured before it, in a
+    background process. When capture stops, the positions of all frames are solved from the offsets between
+    neighbors (see mosaic.solve_positions) and written to ALIGNMENT_PARAMS, which Stitcher.stitch then loads
+    instead of aligning. Nothing is written unless every frame is placed, in which case stitching aligns as usual
+    with the cached features.
+    """
+    def __init__(self, sample: sample.Sample, resize):
+        """
+        Args:
+            sample (sample.Sample): Sample being captured
+            resize (float): First size the sample will be stitched at. Frames are aligned at the size that stitch
+                aligns at.
+        """
+        super().__init__(sample, resize)
+        config = utils.load_config()
+        self._prior_window_mm = config["stitcher"]["PRIOR_SEARCH_WINDOW_MM"]
+        self._alignment_mode = config["stitcher"]["ALIGNMENT_MODE"]
+        self._alignment_size = config["stitcher"]["ALIGNMENT_SIZE"]
+        self._queue = multiprocessing.Queue()
+        self._tiles = {}
+        self._pairs = []
+        self._unmatched = []
+
+    def start(self):
+        self._worker = multiprocessing.Process(target=self._run, daemon=True)
+        self._worker.start()
+
+    def stop(self, wait=True):
+        """Solves and saves the placement once the queued frames are aligned.
+
+        Args:
+            wait (bool, optional): Wait for the placement to be saved. Defaults to True.
+        """
+        # Gantry coordinates of every frame are only complete once capture ends
+        self._queue.put(self.sample.frame_coordinates())
+        super().stop(wait=wait)
+
+    def _run(self):
+        coordinates = {}
+        while True:
+            item = self._queue.get()
+            if isinstance(item, dict):
+                coordinates = item
+                continue
+            for frame_path in self.ready(item):
+                try:
+                    self.align_frame(frame_path)
+                except Exception as e:
+                    log.info("Could not align {} while capturing: {}".format(frame_path, e))
+            if item is None:
+                break
+
+        try:
+            self.save_params(coordinates)
+        except Exception as e:
+            log.info("Could not save alignment from capture: {}".format(e))
+
+    def align_frame(self, frame_path):
+        """Detects the features of a frame and matches it against its neighbors captured so far.
+
+        Args:
+            frame_path (str): Path to the frame, named frame_{row}_{col}_{stack}.tiff
+        """
+        tile = self.fill(frame_path)
+        tile.features_detected = tile.descriptors is not None
+        self._tiles[(tile.row, tile.col)] = tile
+
+        for d_row, d_col in ((-1, 0), (1, 0), (0, -1), (0, 1)):
+            other = self._tiles.get((tile.row + d_row, tile.col + d_col))
+            if other is None:
+                continue
+            offset = tile.estimate_offset(other)
+            if offset is not None:
+                self._pairs.append((tile, other, offset))
+            else:
+                self._unmatched.append((tile, other))
+
+        log.info("Aligned {} while capturing ({} pairs matched, {} unmatched)".format(
+            os.path.basename(frame_path), len(self._pairs), len(self._unmatched)))
+
+    def save_params(self, coordinates, prior_weight=0.01):
+        """Solves the positions of all frames and saves them in the format of MemmapMosaic.save_params.
+
+        Args:
+            coordinates (dict): Gantry coordinates of each frame, see Sample.frame_coordinates. Pairs of frames that
+                could not be matched are held near the offset between their coordinates.
+            prior_weight (float, optional): Weight of a pair held at its coordinates relative to a matched pair.
+                Defaults to 0.01.
+        """
+        rows, cols = self.sample.rows, self.sample.cols
+        if len(self._tiles) != rows * cols:
+            log.info("Captured {} of {} frames, not saving alignment".format(len(self._tiles), rows * cols))
+            return
+
+        def index(tile):
+            return tile.row * cols + tile.col
+
+        pairs = [(index(t), index(o)) for t, o, _ in self._pairs]
+        offsets = [offset for _, _, offset in self._pairs]
+        weights = [1.0] * len(pairs)
+        tolerances = [5.0] * len(pairs)
+
+        # Stage Y runs against the image y axis (see Stitcher.set_priors)
+        tile = next(iter(self._tiles.values()))
+        ppmm = tile.width / self.sample.image_width_mm
+        for t, o in self._unmatched:
+            key_t = (rows - 1 - t.row, t.col)
+            key_o = (rows - 1 - o.row, o.col)
+            if key_t in coordinates and key_o in coordinates:
+                (x_t, y_t, _), (x_o, y_o, _) = coordinates[key_t], coordinates[key_o]
+                pairs.append((index(t), index(o)))
+                offsets.append(((y_o - y_t) * ppmm, (x_t - x_o) * ppmm))
+                weights.append(prior_weight)
+                tolerances.append(self._prior_window_mm * ppmm)
+
+        positions, kept = mosaic_memmap.solve_positions(
+            rows * cols, pairs, offsets, weights=weights, max_residual=tolerances)
+        if np.isnan(positions).any():
+            log.info("Placed {} of {} frames while capturing, not saving alignment".format(
+                int((~np.isnan(positions[:, 0])).sum()), rows * cols))
+            return
+
+        positions = (positions - positions.min(axis=0)) / tile.scale
+        params = {
+            "metadata": {
+                "shape": [rows, cols] + list(tile.shape[2:]),
+                "size": rows * cols,
+                "tile_shape": [int(round(tile.height / tile.scale)), int(round(tile.width / tile.scale))],
+                # Frames are matched by features, standing in for the configured alignment mode
+                **alignment_settings(
+                    self.sample.directory, "features", self._detector, self._alignment_mode, self._alignment_size,
+                    flat_field_digest(self._flat_field_profile)),
+            },
+            "coords": {i: [float(y), float(x)] for i, (y, x) in enumerate(positions)},
+        }
+
+        params_path = os.path.join(self.sample.directory, ALIGNMENT_PARAMS)
+        tmp_path = "{}.{}.tmp".format(params_path, os.getpid())
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(params, f, indent=4)
+        os.replace(tmp_path, params_path)
+        log.info("Saved alignment of {} frames from capture to {} ({} of {} pairs kept)".format(
+            rows * cols, params_path, int(kept.sum()), len(kept)))
+
 class Stitcher:
     def __init__(self, sample: sample.Sample):
         config = utils.load_config()
@@ -39,76 +625,486 @@ class Stitcher:
         self._frame_dir = sample.directory
         self._metadata = None
         self._max_file_size = config["stitcher"]["MAX_FILE_SIZE_GB"] * 1000 # GBs
+        self._ingest_workers = config["stitcher"]["INGEST_WORKERS"]
+        self._use_stage_priors = config["stitcher"]["USE_STAGE_PRIORS"]
+        self._prior_window_mm = config["stitcher"]["PRIOR_SEARCH_WINDOW_MM"]
+        self._detect_in_overlap = config["stitcher"]["DETECT_IN_OVERLAP"]
+        self._aligner = config["stitcher"]["ALIGNER"]
+        self._tile_class = ALIGNERS[self._aligner]
+        self._detector = config["stitcher"]["DETECTOR"]
+        self._reuse_alignment = config["stitcher"]["REUSE_ALIGNMENT"]
+        self._alignment_size = config["stitcher"]["ALIGNMENT_SIZE"]
+        self._refine_window_px = config["stitcher"]["REFINE_WINDOW_PX"]
+        self._alignment_mode = config["stitcher"]["ALIGNMENT_MODE"]
+        self._align_workers = config["stitcher"]["ALIGN_WORKERS"]
+        self._align_backend = config["stitcher"]["ALIGN_BACKEND"]
+        self._block_size = config["stitcher"]["BLOCK_SIZE"]
+        self._block_overlap = config["stitcher"]["BLOCK_OVERLAP"]
+        # Runs blocks when ALIGNMENT_MODE is "blocks". Set to an executor for remote workers, otherwise blocks run
+        # in a local process pool with ALIGN_WORKERS processes.
+        self.block_executor = None
+        self._shared_features = config["stitcher"]["SHARED_FEATURES"]
+        self._feature_store = None
+        self._use_planes = config["stitcher"]["ALIGNMENT_PLANES"]
+        self._plane_scale = config["stitcher"]["ALIGNMENT_PLANE_SCALE"]
+        self._plane_paths = None
+        self._checkpoint_alignment = config["stitcher"]["CHECKPOINT_ALIGNMENT"]
+        self._memory_budget = config["stitcher"]["MEMORY_BUDGET_GB"] * 1e9
+        self._cell_compositing = config["stitcher"]["CELL_COMPOSITING"]
+        self._gain_compensation = config["stitcher"]["GAIN_COMPENSATION"]
+        self._smooth_seams = config["stitcher"]["SMOOTH_SEAMS"]
+        self._flat_field = config["stitcher"]["FLAT_FIELD"]
+        self._flat_field_frames = config["stitcher"]["FLAT_FIELD_FRAMES"]
+        self._flat_field_profile = None
+        self._flat_field_corrections = {}
+        # Correction applied by the tiles to frames mapped in place, which are not corrected when ingested
+        self._tile_flat_field = None
+        # Digest of the profile the data features are detected in was corrected with, see feature_cache_key
+        self._features_flat_field = None
+        self._draw_band_height = config["stitcher"]["DRAW_BAND_HEIGHT"]
+        self._draw_workers = config["stitcher"]["DRAW_WORKERS"]
+        self._draw_memory = config["stitcher"]["DRAW_MEMORY_GB"] * 1e9
+        self._governor = None
+        self._feature_cache = None
+        if config["stitcher"]["FEATURE_CACHE"]:
+            self._feature_cache = features.FeatureCache(os.path.join(self._frame_dir, "feature_cache"))
+        self._resize = 1.0
+        self._scale = 1.0
 
         self.load_metadata()
         
     # @profile
     def write_dats(self, dats_path, resize = None):
+        """Decodes, resizes and writes every frame to a .dat cache using a pool of worker threads.
+
+        Decoding, cv2.resize and the memmap writes all release the GIL, so threads keep every core busy without
+        pickling frames between processes. Each worker only holds the frame it is working on and hands back its
+        shape, so at most INGEST_WORKERS frames are in memory at once. Output paths depend only on the sorted
+        frame index, so they are the same no matter which worker finishes first.
+
+        Args:
+            dats_path (str): Directory to write the .dat files to
+            resize (float, optional): Fraction of the original width to resize the frames to. Defaults to None.
+
+        Returns:
+            tuple: Shape of a single resized frame
+        """
         # Create dats directory 
         if not os.path.exists(dats_path):
             os.makedirs(dats_path)
 
-        i = 0
         tile_paths = self.get_frames()
-        self._memmap_paths = []
-        first = True
-        for tile_path in tile_paths:
-            with rasterio.open(os.path.join(self._frame_dir, tile_path)) as dataset:
-                data = np.transpose(dataset.read(), (1, 2, 0))
-                if resize is not None and resize > 0 and resize < 1.0:
-                    data = imutils.resize(data, width = int(resize * data.shape[1]))
-
-                self._memmap_shape = (data.shape[0], data.shape[1], data.shape[2])
-
-                # create a placeholder dat 
-                if first:
-                    memmap_path = os.path.join(dats_path, "placeholder_memmap_array.dat")
-                    memmap_array = np.memmap(memmap_path, dtype = dataset.dtypes[0], mode='w+', shape=(data.shape[0], data.shape[1], data.shape[2]))
-                    data = np.full((data.shape[0], data.shape[1], data.shape[2]), 0, dataset.dtypes[0])
-                    memmap_array[:] = data[:]
-                    memmap_array.flush()
-                    del memmap_array
-                    first = False
-
-                memmap_path = os.path.join(dats_path, "{}_".format(i) + "memmap_array.dat")
-                self._memmap_paths.append(memmap_path)
-                self._memmap_dtype = dataset.dtypes[0]
-                memmap_array = np.memmap(memmap_path, dtype=dataset.dtypes[0], mode='w+', shape=(data.shape[0], data.shape[1], data.shape[2]))
-                i+=1
-                memmap_array[:] = data[:]
-                memmap_array.flush()
-
-                
-                # memmap_read_only = np.memmap(os.path.join(dats_path, "{}_".format(i) + "memmap_array.dat"), dtype=dataset.dtypes[0], mode='r', shape=(data.shape[0], data.shape[1], data.shape[2]))
-                # self._memmaps.append(memmap_array)
-
-                # flush to save the array
-                del memmap_array
-                del dataset
-                del data
-        
-        # print(sys.getsizeof(self._memmaps))
+        self._frame_names = tile_paths
+        self._memmap_paths = [os.path.join(dats_path, "{}_".format(i) + "memmap_array.dat") for i in range(len(tile_paths))]
+        self._memmap_offsets = [0] * len(tile_paths)
+
+        flat_field = None
+        if self._flat_field:
+            with tifffile.TiffFile(os.path.join(self._frame_dir, tile_paths[0])) as tif:
+                frame_shape = tif.pages[0].shape
+            width = int((resize or 1.0) * frame_shape[1])
+            height = int(frame_shape[0] * width / float(frame_shape[1]))
+            flat_field = self.flat_field_correction((height, width) + tuple(frame_shape[2:]))
+
+        start_time = time.time()
+        pool = Parallel(n_jobs=self._ingest_workers, prefer="threads", pre_dispatch="n_jobs")
+        results = pool(
+            delayed(ingest_frame)(os.path.join(self._frame_dir, tile_path), memmap_path, resize or 1.0, flat_field)
+            for tile_path, memmap_path in zip(tile_paths, self._memmap_paths)
+        )
+        elapsed = max(time.time() - start_time, 1e-6)
+
+        shapes = {shape for shape, _, _ in results}
+        if len(shapes) > 1:
+            raise ValueError("Frames resized to different shapes: {}".format(shapes))
+
+        self._memmap_shape = results[0][0]
+        self._memmap_dtype = results[0][1]
+
+        # create a placeholder dat 
+        memmap_path = os.path.join(dats_path, "placeholder_memmap_array.dat")
+        memmap_array = np.memmap(memmap_path, dtype = self._memmap_dtype, mode='w+', shape=self._memmap_shape)
+        memmap_array[:] = 0
+        memmap_array.flush()
+        del memmap_array
+
+        mb_read = sum(n for _, _, n in results) / 1e6
+        log.info("Wrote dats: {} frames in {:.1f} s using {} workers ({:.2f} frames/s, {:.1f} MB/s)".format(
+            len(results), elapsed, self._ingest_workers, len(results) / elapsed, mb_read / elapsed))
+
         gc.collect()
-        log.info("Wrote dats")
         return self._memmap_shape
 
+    def flat_field_correction(self, shape):
+        """Gets the flat-field correction for frames of the given shape, estimating the profile on first use.
+
+        The profile is shared by every sample captured at the same zoom (see flat_field_path), so it is only
+        estimated for the first of them, and samples with too few frames with tissue use the profile of an earlier
+        sample. It is estimated from up to FLAT_FIELD_FRAMES frames spread over the capture, leaving out frames
+        flagged as background. Delete the profile to estimate it again, e.g. after the light is changed. The
+        correction for each frame shape is kept, so every stitch size scales the profile once.
+
+        Args:
+            shape (tuple): Shape of the frames to correct as (height, width, channels)
+
+        Returns:
+            numpy.ndarray: float32 correction with the given shape, or None if there is no profile for the zoom
+                and too few frames with tissue to estimate one
+        """
+        shape = tuple(shape)
+        if shape in self._flat_field_corrections:
+            return self._flat_field_corrections[shape]
+
+        if self._flat_field_profile is None:
+            frame_names = self.get_frames()
+            with tifffile.TiffFile(os.path.join(self._frame_dir, frame_names[0])) as tif:
+                profile_path = flat_field_path(self.sample, tif.pages[0].shape)
+
+            if os.path.exists(profile_path):
+                self._flat_field_profile = np.load(profile_path)
+                log.info("Loaded flat field from {}".format(profile_path))
+            else:
+                pattern = re.compile(r'frame_(-?\d+)_(-?\d+)')
+                background = self.sample.background_frames()
+                frame_paths = [
+                    os.path.join(self._frame_dir, name) for name in frame_names
+                    if tuple(int(g) for g in pattern.match(name).groups()) not in background]
+
+                if len(frame_paths) < FLAT_FIELD_MIN_FRAMES:
+                    log.info("Skipping flat-field correction, only {} frames with tissue and no profile for this "
+                             "zoom".format(len(frame_paths)))
+                    self._flat_field_corrections[shape] = None
+                    return None
+
+                step = max(1, len(frame_paths) // self._flat_field_frames)
+                frame_paths = frame_paths[::step][:self._flat_field_frames]
+                start_time = time.time()
+                self._flat_field_profile = estimate_flat_field(frame_paths, workers=self._ingest_workers)
+                log.info("Estimated flat field from {} frames in {:.1f} s (falloff to {:.2f})".format(
+                    len(frame_paths), time.time() - start_time, self._flat_field_profile.min()))
+
+                save_flat_field(self._flat_field_profile, profile_path)
+
+        correction = flat_field_correction(self._flat_field_profile, shape)
+        self._flat_field_corrections[shape] = correction
+        return correction
+
+    def map_frames(self, dats_path):
+        """Maps the pixel strips of the captured TIFFs in place rather than copying them into .dat files.
+
+        The frames written by avenc_tiff are uncompressed, so their pixel data can be handed to the tiles as a
+        read-only memmap at the strip offset. Any frame that can not be mapped (compressed, tiled, etc.) falls
+        back to a .dat copy in dats_path.
+
+        Args:
+            dats_path (str): Directory for .dat copies of frames which can not be mapped in place
+
+        Returns:
+            tuple: Shape of a single frame
+        """
+        tile_paths = self.get_frames()
+        self._frame_names = tile_paths
+        self._memmap_paths = []
+        self._memmap_offsets = []
+        copied = 0
+
+        for i, tile_path in enumerate(tile_paths):
+            frame_path = os.path.join(self._frame_dir, tile_path)
+            with tifffile.TiffFile(frame_path) as tif:
+                page = tif.pages[0]
+                self._memmap_shape = page.shape
+                self._memmap_dtype = page.dtype
+
+                if page.is_memmappable:
+                    self._memmap_paths.append(frame_path)
+                    self._memmap_offsets.append(page.dataoffsets[0])
+                    continue
+
+                data = page.asarray()
+
+            # Frame can't be mapped directly, write a .dat copy instead
+            if not os.path.exists(dats_path):
+                os.makedirs(dats_path)
+
+            memmap_path = os.path.join(dats_path, "{}_".format(i) + "memmap_array.dat")
+            memmap_array = np.memmap(memmap_path, dtype=data.dtype, mode='w+', shape=data.shape)
+            memmap_array[:] = data[:]
+            memmap_array.flush()
+            del memmap_array
+            del data
+
+            self._memmap_paths.append(memmap_path)
+            self._memmap_offsets.append(0)
+            copied += 1
+
+        log.info("Mapped {} frames in place, copied {} frames to dats".format(len(tile_paths) - copied, copied))
+        return self._memmap_shape
+
+    def write_planes(self, dats_path):
+        """Writes a single-channel alignment plane for every tile, so alignment never reads the color data.
+
+        Args:
+            dats_path (str): Directory to write the planes to
+
+        Returns:
+            tuple: Shape of a single plane
+        """
+        if not os.path.exists(dats_path):
+            os.makedirs(dats_path)
+
+        self._plane_paths = [os.path.join(dats_path, "{}_plane.dat".format(i)) for i in range(len(self._memmap_paths))]
+
+        start_time = time.time()
+        pool = Parallel(n_jobs=self._ingest_workers, prefer="threads", pre_dispatch="n_jobs")
+        shapes = pool(
+            delayed(write_plane)(
+                np.memmap(path, dtype=self._memmap_dtype, mode='r', offset=offset, shape=self._memmap_shape),
+                plane_path,
+                self._plane_scale,
+                self._tile_flat_field,
+            )
+            for path, offset, plane_path in zip(self._memmap_paths, self._memmap_offsets, self._plane_paths)
+        )
+        self._plane_shape = shapes[0]
+
+        log.info("Wrote {} alignment planes of shape {} in {:.1f} s".format(
+            len(shapes), self._plane_shape, time.time() - start_time))
+        return self._plane_shape
+
     # @profile
     def read_dats(self):
         del self._memmaps
 
         self._memmaps = []
 
-        for path in self._memmap_paths:
-            memmap_array = np.memmap(path, dtype=self._memmap_dtype, mode='r', shape=(self._memmap_shape[0], self._memmap_shape[1], self._memmap_shape[2]))
+        for path, offset in zip(self._memmap_paths, self._memmap_offsets):
+            memmap_array = np.memmap(path, dtype=self._memmap_dtype, mode='r', offset=offset, shape=(self._memmap_shape[0], self._memmap_shape[1], self._memmap_shape[2]))
             self._memmaps.append(memmap_array)
 
     def create_tiles(self):
-        for path in self._memmap_paths:
-            self._tiles.append(tile_memmap.MemmapOpenCVTile(path, self._memmap_shape))
+        for i, (path, offset) in enumerate(zip(self._memmap_paths, self._memmap_offsets)):
+            tile = self._tile_class(path, self._memmap_shape, detector=self._detector, offset=offset)
+            tile.scale = self._scale
+            tile.feature_store = self._feature_store
+            tile.flat_field = self._tile_flat_field
+
+            # Detection and matching read the single-channel plane instead of the color data
+            if self._plane_paths is not None:
+                tile.plane_path = self._plane_paths[i]
+                tile.plane_shape = self._plane_shape
+                tile.plane_scale = self._plane_shape[1] / self._memmap_shape[1]
+
+            # Only look for features where the tile can overlap a neighbor
+            if self._detect_in_overlap:
+                tile.overlap = self._metadata["percent_overlap"] / 100
+            self._tiles.append(tile)
         log.info("Created tiles")
 
+    def set_cache_keys(self):
+        """Keeps the features of every tile in the feature cache of the sample, under a key built from its frame, so
+        they are reused by later stitches and retries and can be filled in during capture (see FeatureCacheFiller).
+        Needs the mosaic grid, since the regions searched depend on the neighbors of each tile.
+        """
+        start_time = time.time()
+        for name, tile in zip(self._frame_names, self._tiles):
+            tile.feature_store = self._feature_cache
+            tile.cache_key = feature_cache_key(
+                self._feature_cache, os.path.join(self._frame_dir, name), tile, self._features_flat_field)
+
+        cached = sum(tile.features_stored for tile in self._tiles)
+        log.info("Found cached features for {} of {} tiles in {:.1f} s".format(
+            cached, len(self._tiles), time.time() - start_time))
+
+    def pixels_per_mm(self):
+        """Pixels per mm of the tiles, from the DPI of the sample if it is set or the field of view otherwise"""
+        if self.sample.dpi is not None:
+            # The DPI of the sample is set for the size being stitched, which may differ from the current tiles
+            return self.sample.dpi / 25.4 * self._scale / self._resize
+        return self._memmap_shape[1] / self.sample.image_width_mm
+
+    def load_level(self, resize, dats_path):
+        """Creates the tiles and mosaic for the frames at the given size.
+
+        Args:
+            resize (float): Fraction of the original width to resize the frames to, 1.0 to map them in place
+            dats_path (str): Directory to write the .dat files to
+        """
+        self._tile_flat_field = None
+        if resize < 1.0:
+            log.info("Writing dats with resize {}".format(resize))
+            self.write_dats(dats_path, resize = resize)
+            self._features_flat_field = flat_field_digest(self._flat_field_profile)
+        else:
+            # Full resolution tiles read straight from the captured frames
+            log.info("Mapping frames in place")
+            self.map_frames(dats_path)
+
+            # Mapped frames are corrected in their alignment planes and as they are drawn instead of when ingested.
+            # Features detected without planes come from the uncorrected frames.
+            if self._flat_field:
+                self._tile_flat_field = self.flat_field_correction(self._memmap_shape)
+            self._features_flat_field = None
+            if self._tile_flat_field is not None and self._use_planes:
+                self._features_flat_field = flat_field_digest(self._flat_field_profile)
+
+        with tifffile.TiffFile(os.path.join(self._frame_dir, self._frame_names[0])) as tif:
+            self._scale = self._memmap_shape[1] / tif.pages[0].shape[1]
+
+        if self._use_planes:
+            self.write_planes(dats_path)
+
+        # Features are written once to files every worker maps, instead of being pickled with the tiles
+        if self._shared_features and self._feature_cache is None:
+            self._feature_store = features.FeatureStore(os.path.join(dats_path, "features"))
+
+        log.info("Creating Tiles")
+        self.create_tiles()
+        log.info("Creating Mosaic")
+        self.create_mosaic()
+
+        # Batches of detection and matching are sized to stay under the memory budget
+        if self._memory_budget > 0:
+            self._governor = memory.MemoryGovernor(
+                self._memory_budget, workers=self._align_workers, spill_directory=os.path.join(dats_path, "spill"))
+            self._mosaic.governor = self._governor
+            log.info("Limiting alignment to {}".format(self._governor))
+
+        if self._feature_cache is not None:
+            self.set_cache_keys()
+
+    def align(self, params_path=None):
+        """Places the tiles, reusing the placement cached in params_path if it matches this sample.
+
+        A cached placement is refined with a search of REFINE_WINDOW_PX pixels around each tile, or used as is if
+        the window is 0. Otherwise the tiles are aligned from scratch and the placement is cached.
+
+        Wavefront alignments are checkpointed to ALIGNMENT_CHECKPOINT after each ring of tiles if
+        CHECKPOINT_ALIGNMENT is set, and resume from it if a previous stitch was interrupted at the same size in the
+        same phase. The checkpoint is removed if alignment fails, so a retry starts from scratch.
+
+        Args:
+            params_path (str, optional): Path of the cached placement. Defaults to None.
+        """
+        checkpoint = None
+        if self._checkpoint_alignment:
+            checkpoint = os.path.join(self._frame_dir, ALIGNMENT_CHECKPOINT)
+
+        if params_path is not None and os.path.exists(params_path):
+            try:
+                self._mosaic.load_params(params_path)
+            except ValueError:
+                log.info("Cached alignment does not match the frames, aligning again")
+            else:
+                if self._refine_window_px > 0:
+                    log.info("Refining cached alignment")
+                    try:
+                        self._mosaic.refine(window=self._refine_window_px, checkpoint=checkpoint)
+                    except Exception:
+                        # A retry starts from scratch instead of resuming the state that failed
+                        self.remove_checkpoint(checkpoint)
+                        raise
+                    self.remove_checkpoint(checkpoint)
+                return
+
+        window = None
+        if self._use_stage_priors and self.set_priors():
+            window = self._prior_window_mm * self.pixels_per_mm()
+        log.info("Aligning")
+        try:
+            if self._alignment_mode == "global":
+                self._mosaic.align_global(window=window)
+            elif self._alignment_mode == "blocks":
+                self._mosaic.align_blocks(
+                    block_size=self._block_size,
+                    overlap=self._block_overlap,
+                    executor=self.block_executor,
+                    window=window,
+                )
+            else:
+                self._mosaic.align(window=window, checkpoint=checkpoint)
+        except Exception:
+            self.remove_checkpoint(checkpoint)
+            raise
+
+        if params_path is not None:
+            self._mosaic.save_params(params_path)
+        self.remove_checkpoint(checkpoint)
+
+    @staticmethod
+    def remove_checkpoint(checkpoint):
+        """Removes the checkpoint of a finished alignment.
+
+        Args:
+            checkpoint (str): Path of the checkpoint, or None if alignment is not checkpointed
+        """
+        if checkpoint is not None and os.path.exists(checkpoint):
+            os.remove(checkpoint)
+
+    def align_coarse(self, params_path):
+        """Aligns the frames at ALIGNMENT_SIZE and caches the placement in params_path.
+
+        Args:
+            params_path (str): Path to cache the placement to
+        """
+        dats_path = os.path.join(self._frame_dir, "alignment_dats")
+        log.info("Aligning at coarse size {}".format(self._alignment_size))
+        try:
+            self.load_level(self._alignment_size, dats_path)
+            self.align(params_path)
+        except RuntimeError:
+            # Nothing is cached, so the requested size is aligned from scratch instead
+            log.info("Could not align at coarse size {}".format(self._alignment_size))
+        finally:
+            dats_path, self.dats_path = self.dats_path, dats_path
+            self.delete_dats()
+            self.dats_path = dats_path
+            self._memmaps = []
+            self._tiles = []
+            self._mosaic = None
+            self._plane_paths = None
+
+    def set_priors(self):
+        """Seeds each tile with the mosaic position predicted from the gantry coordinates it was captured at.
+
+        Stage Y increases towards the top of the sample and stage X towards the right (see Sample._top_left), so
+        the image y axis runs against stage Y. Only differences between priors are used during alignment.
+
+        Returns:
+            int: Number of tiles which received a prior
+        """
+        pattern = re.compile(r'frame_(-?\d+)_(-?\d+)')
+        coordinates = self.sample.frame_coordinates()
+        if not coordinates:
+            return 0
+
+        ppmm = self.pixels_per_mm()
+        x_min = min(c[0] for c in coordinates.values())
+        y_max = max(c[1] for c in coordinates.values())
+
+        count = 0
+        for name, tile in zip(self._frame_names, self._tiles):
+            match = pattern.match(name)
+            key = (int(match.group(1)), int(match.group(2)))
+            if key in coordinates:
+                x, y, _ = coordinates[key]
+                tile.prior_y = (y_max - y) * ppmm
+                tile.prior_x = (x - x_min) * ppmm
+                count += 1
+
+        log.info("Set stage priors for {} of {} tiles".format(count, len(self._tiles)))
+        return count
+
     def create_mosaic(self):
         self._mosaic = mosaic_memmap.MemmapStructuredMosaic(self._tiles, dim=self._metadata["cols"])
+        # A cached placement is only reused by stitches with the same settings and frames
+        self._mosaic.settings = alignment_settings(
+            self._frame_dir, self._aligner, self._detector, self._alignment_mode, self._alignment_size,
+            flat_field_digest(self._flat_field_profile))
+
+        # Detection and matching release the GIL, so threads use every core without pickling tiles. With
+        # processes, only coordinates and status travel between workers if features are shared.
+        self._mosaic.num_cores = self._align_workers
+        self._mosaic.pool = Parallel(n_jobs=self._align_workers, prefer=self._align_backend)
         log.info("Created mosaic")
 
     def delete_dats(self):
@@ -119,13 +1115,17 @@ class Stitcher:
 
         gc.collect()
 
-        if os.path.exists(self.dats_path):
-            files = glob.glob(os.path.join(self.dats_path, "*"))
+        if self._feature_store is not None:
+            self._feature_store.clear()
+            self._feature_store = None
 
-            for file in files:
-                os.remove(file)
+        if self._governor is not None:
+            self._governor.clear()
+            self._governor = None
 
-            os.rmdir(self.dats_path)
+        # Also removes anything left in the dats by a stitch that was killed
+        if os.path.exists(self.dats_path):
+            shutil.rmtree(self.dats_path)
 
 
     def load_metadata(self):
@@ -159,6 +1159,38 @@ class Stitcher:
         
         log.info(sorted_paths)
         return sorted_paths
+    def build(self, path, mosaic_dat_path):
+        """Aligns the frames at the current size and draws the mosaic.
+
+        Args:
+            path (str): Output directory for this size
+            mosaic_dat_path (str): Path of the mosaic .dat file to write
+
+        Returns:
+            tuple: Shape of the mosaic
+        """
+        # Align once at the coarse level, every other size then reuses the cached placement
+        params_path = os.path.join(self._frame_dir, ALIGNMENT_PARAMS)
+        if self._reuse_alignment and self._alignment_size < self._resize and not os.path.exists(params_path):
+            self.align_coarse(params_path)
+
+        self.load_level(self._resize, self.dats_path)
+        self.align(params_path if self._reuse_alignment else None)
+        # Gains and gammas are applied as the mosaic is drawn, so seams are evened out without rewriting any tile
+        # Gains are solved for every tile at once, so the tile-by-tile gamma propagation is only a fallback
+        if self._gain_compensation:
+            self._mosaic.compensate_gains()
+        elif self._smooth_seams:
+            self._mosaic.smooth_seams()
+
+        if not os.path.exists(path):
+            os.mkdir(path)
+
+        # The mosaic is drawn in row bands assembled in memory and written sequentially
+        return self._mosaic.save(
+            mosaic_dat_path, cells=self._cell_compositing, band_height=self._draw_band_height,
+            workers=self._draw_workers, max_memory=self._draw_memory)
+
     # @profile
     def stitch(self, resize=None):
         start_time = time.time()
@@ -171,22 +1203,9 @@ class Stitcher:
             mosaic_dat_path = os.path.join(path, "mosaic_100per.dat")
         
         self.dats_path = os.path.join(path, "dats")
-        log.info("Writing dats with resize {}".format(resize))
-        memmap_shape = self.write_dats(self.dats_path, resize = resize)
-        log.info("Creating Tiles")
-        # self.read_dats()
-        # log.info("Reading dats")
-        self.create_tiles()
-        log.info("Creating Mosaic")
-        self.create_mosaic()
-        log.info("Aligning")
-        self._mosaic.align()
-        # self._mosaic.smooth_seams()
-
-        if not os.path.exists(path):
-            os.mkdir(path)
+        self._resize = resize if resize is not None and resize < 1.0 and resize > 0 else 1.0
 
-        shape = self._mosaic.save(mosaic_dat_path)
+        shape = self.build(path, mosaic_dat_path)
 
         end_time = time.time()
         self.sample.set_end_time_stitching(end_time)
@@ -213,6 +1232,187 @@ class Stitcher:
             raise MaxFileSizeException(self._max_file_size)
 
 
+class StripStitcher(Stitcher):
+    """Stitches a single column of frames, as captured for cores, without building a mosaic.
+
+    Frames are read one at a time from the top of the core down, ordered by the stage Y they were captured at (see
+    order). Each frame is only compared with the one above it, by phase correlation of the band they are expected to
+    share, so the search is limited to the known overlap. The strip is then written to the output frame by frame,
+    with the flat-field correction applied as each frame is drawn. Matching uses the uncorrected bands.
+    """
+    #: float : Largest distance from the expected offset, as a fraction of the frame height, a match can move a frame
+    search_radius = 0.05
+
+    #: float : Smallest height of the correlation peak accepted as a match
+    min_confidence = 0.1
+
+    def build(self, path, mosaic_dat_path):
+        """Places the frames down the strip and writes them to the mosaic.
+
+        Args:
+            path (str): Output directory for this size
+            mosaic_dat_path (str): Path of the mosaic .dat file to write
+
+        Returns:
+            tuple: Shape of the mosaic
+        """
+        self._frame_names = self.order(self.get_frames())
+        frame_paths = [os.path.join(self._frame_dir, name) for name in self._frame_names]
+        overlap = self._metadata["percent_overlap"] / 100
+
+        start_time = time.time()
+        positions = self.place(frame_paths, overlap)
+        log.info("Placed {} frames in {:.1f} s".format(len(positions), time.time() - start_time))
+
+        if not os.path.exists(path):
+            os.mkdir(path)
+
+        start_time = time.time()
+        shape = self.draw(frame_paths, positions, mosaic_dat_path)
+        log.info("Drew strip of shape {} in {:.1f} s".format(shape, time.time() - start_time))
+        return shape
+
+    def order(self, frame_names):
+        """Orders the frames from the top of the strip down.
+
+        capture_core_bottom numbers frames upwards as it jogs down the core, while capture_core_middle_2 numbers
+        them away from the middle in both directions, so the frame names do not give the direction of the strip.
+        Stage Y increases towards the top of the sample, so frames are sorted by the Y coordinate recorded for them
+        when every frame has one. Otherwise the order of get_frames is kept, highest row first, which is the top of
+        the core for the sections captured by capture_core_middle_2.
+
+        Args:
+            frame_names (list): Names of the frames as returned by get_frames
+
+        Returns:
+            list: Names of the frames from the top of the strip down
+        """
+        pattern = re.compile(r'frame_(-?\d+)_(-?\d+)')
+        coordinates = self.sample.frame_coordinates()
+        keys = [(int(match.group(1)), int(match.group(2))) for match in map(pattern.match, frame_names)]
+        if not coordinates or not all(key in coordinates for key in keys):
+            log.info("No stage coordinates for every frame, ordering the strip by frame name")
+            return frame_names
+
+        order = sorted(range(len(frame_names)), key=lambda k: -coordinates[keys[k]][1])
+        return [frame_names[k] for k in order]
+
+    def place(self, frame_paths, overlap):
+        """Finds the position of each frame from its offset to the frame above it.
+
+        Args:
+            frame_paths (list): Paths of the frames from the top of the strip down
+            overlap (float): Fraction of the frame height shared by consecutive frames
+
+        Returns:
+            list: Position of each frame as (y, x) at the current size
+        """
+        positions = [(0.0, 0.0)]
+        previous = None
+        missed = 0
+        for frame_path in frame_paths:
+            data = read_frame(frame_path)
+            height = int(data.shape[0] * int(self._resize * data.shape[1]) / float(data.shape[1]))
+            step = int(round(height * (1 - overlap)))
+
+            # Only the rows shared with the neighbors are read from the frame
+            band = int(math.ceil((height - step) / self._resize)) + 1
+            top = self.band(data[:band], height - step)
+            if previous is not None:
+                match = self.offset(previous, top, step)
+                if match is None:
+                    missed += 1
+                    match = float(step), 0.0
+                dy, dx = match
+                y, x = positions[-1]
+                positions.append((y + dy, x + dx))
+            previous = self.band(data[data.shape[0] - band:], height - step, bottom=True)
+
+        # Frames out of order or a wrong overlap leave bands which never match, and the strip is then just the frames
+        # stacked at the nominal step
+        if 2 * missed > len(positions) - 1:
+            log.warning("{} of {} frames did not match the frame above, the strip is placed from the expected "
+                        "offsets".format(missed, len(positions) - 1))
+        return positions
+
+    def band(self, data, rows, bottom=False):
+        """Converts rows of a frame to a single-channel float32 band at the current size.
+
+        Args:
+            data (numpy.ndarray): Rows at the top or bottom of a frame
+            rows (int): Number of rows of the band at the current size
+            bottom (bool, optional): Keep the last rows instead of the first. Defaults to False.
+
+        Returns:
+            numpy.ndarray: Band with shape (rows, width)
+        """
+        plane = make_plane(data, self._resize)
+        plane = plane[-rows:] if bottom else plane[:rows]
+        return np.float32(plane)
+
+    def offset(self, upper, lower, step):
+        """Estimates the offset of a frame from the frame above it by phase correlation of their shared band.
+
+        Args:
+            upper (numpy.ndarray): Bottom band of the frame above
+            lower (numpy.ndarray): Top band of the frame
+            step (int): Expected distance in pixels between the tops of the frames
+
+        Returns:
+            tuple: Offset as (dy, dx), or None if the bands do not match
+        """
+        rows = min(len(upper), len(lower))
+        width = min(upper.shape[1], lower.shape[1])
+        upper, lower = upper[len(upper) - rows:, :width], lower[:rows, :width]
+
+        window = cv2.createHanningWindow((width, rows), cv2.CV_32F)
+        (shift_x, shift_y), response = cv2.phaseCorrelate(lower, upper, window)
+
+        radius = self.search_radius * (step + rows)
+        if response < self.min_confidence or max(abs(shift_y), abs(shift_x)) > radius:
+            log.info("Frames did not match (response {:.2f}), using expected offset".format(response))
+            return None
+        return step + shift_y, shift_x
+
+    def draw(self, frame_paths, positions, mosaic_dat_path):
+        """Writes the frames to the mosaic one at a time, each over the one above it.
+
+        Args:
+            frame_paths (list): Paths of the frames from the top of the strip down
+            positions (list): Position of each frame as (y, x), see place
+            mosaic_dat_path (str): Path of the mosaic .dat file to write
+
+        Returns:
+            tuple: Shape of the mosaic
+        """
+        data = read_frame(frame_paths[0])
+        width = int(self._resize * data.shape[1])
+        height = int(data.shape[0] * width / float(data.shape[1]))
+
+        ys = np.round([y for y, _ in positions]).astype(int)
+        xs = np.round([x for _, x in positions]).astype(int)
+        ys -= ys.min()
+        xs -= xs.min()
+        shape = (int(ys.max()) + height, int(xs.max()) + width, data.shape[2])
+
+        flat_field = None
+        if self._flat_field:
+            flat_field = self.flat_field_correction((height, width) + tuple(data.shape[2:]))
+
+        mosaic = np.memmap(mosaic_dat_path, dtype='uint8', mode='w+', shape=shape)
+        for frame_path, y, x in zip(frame_paths, ys, xs):
+            frame = read_frame(frame_path)
+            if self._resize < 1.0:
+                frame = resize_frame(frame, self._resize)
+            if flat_field is not None:
+                frame = cv2.multiply(np.asarray(frame), flat_field, dtype=cv2.CV_8U)
+            mosaic[y:y + frame.shape[0], x:x + frame.shape[1]] = frame
+            mosaic.flush()
+        del mosaic
+
+        return shape
+
+
 if __name__ == "__main__":
     def stitch_multiple_sizes(path, sizes):
         for size in sizes:
@@ -0,0 +1,109 @@
+# Deterministic checks of the sparse solvers in mosaic.py on small synthetic problems
+#
+# python -m pytest tests
+
+import os
+import sys
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from mosaic import solve_gains, solve_positions
+
+
+def grid_problem(rows=4, cols=4, noise=0.2, seed=0):
+    """Positions of a jittered grid and the offsets between horizontal and vertical neighbors"""
+    rng = np.random.default_rng(seed)
+    positions = np.array(
+        [(r * 150.0, c * 200.0) for r in range(rows) for c in range(cols)]
+    ) + rng.uniform(-5, 5, (rows * cols, 2))
+
+    pairs = []
+    for r in range(rows):
+        for c in range(cols):
+            i = r * cols + c
+            if c + 1 < cols:
+                pairs.append((i + 1, i))
+            if r + 1 < rows:
+                pairs.append((i + cols, i))
+    offsets = [positions[i] - positions[j] + rng.normal(0, noise, 2) for i, j in pairs]
+    return positions, pairs, offsets
+
+
+def test_solve_positions_recovers_grid():
+    positions, pairs, offsets = grid_problem()
+    solved, kept = solve_positions(len(positions), pairs, offsets)
+
+    assert kept.all()
+    np.testing.assert_allclose(solved - solved[0], positions - positions[0], atol=1.0)
+
+
+def test_solve_positions_rejects_outliers():
+    positions, pairs, offsets = grid_problem()
+    offsets[3] = offsets[3] + (40.0, -25.0)
+    offsets[10] = offsets[10] + (-30.0, 30.0)
+    solved, kept = solve_positions(len(positions), pairs, offsets)
+
+    assert not kept[3] and not kept[10]
+    assert kept.sum() == len(pairs) - 2
+    np.testing.assert_allclose(solved - solved[0], positions - positions[0], atol=1.0)
+
+
+def test_solve_positions_leaves_unconnected_positions_unsolved():
+    positions, pairs, offsets = grid_problem(rows=2, cols=2)
+    solved, _ = solve_positions(len(positions) + 1, pairs, offsets)
+
+    assert np.isnan(solved[-1]).all()
+    assert not np.isnan(solved[:-1]).any()
+
+
+def gain_problem(seed=0):
+    """Overlaps of a 3x3 grid of tiles with known exposures over a flat scene"""
+    rng = np.random.default_rng(seed)
+    exposures = rng.uniform(0.8, 1.25, (9, 3))
+    stats = []
+    for r in range(3):
+        for c in range(3):
+            i = r * 3 + c
+            for j in (i + 1 if c < 2 else None, i + 3 if r < 2 else None):
+                if j is not None:
+                    scene = rng.uniform(80, 160, 3)
+                    stats.append((i, j, scene * exposures[i], scene * exposures[j], 500))
+    return exposures, stats
+
+
+def gain_error_gradient(gains, stats, sigma_n, sigma_g):
+    """Gradient of the Brown and Lowe gain error, summed over both orderings of each pair"""
+    gradient = np.zeros_like(gains)
+    for i, j, mean_i, mean_j, count in stats:
+        for a, ma, o, mo in ((i, mean_i, j, mean_j), (j, mean_j, i, mean_i)):
+            residual = gains[a] * ma - gains[o] * mo
+            gradient[a] += 2 * count * (residual * ma / sigma_n ** 2 - (1 - gains[a]) / sigma_g ** 2)
+            gradient[o] -= 2 * count * residual * mo / sigma_n ** 2
+    return gradient
+
+
+def test_solve_gains_equalizes_exposures():
+    exposures, stats = gain_problem()
+    gains = solve_gains(len(exposures), stats, sigma_n=10.0, sigma_g=1.0)
+
+    # Adjusted exposures agree with each other, whatever their common scale
+    adjusted = gains * exposures
+    np.testing.assert_allclose(adjusted / adjusted.mean(axis=0), 1.0, atol=0.01)
+
+
+def test_solve_gains_minimizes_error():
+    exposures, stats = gain_problem(seed=1)
+    gains = solve_gains(len(exposures), stats, sigma_n=10.0, sigma_g=0.1)
+
+    gradient = gain_error_gradient(gains, stats, 10.0, 0.1)
+    scale = np.abs(gain_error_gradient(np.ones_like(gains), stats, 10.0, 0.1)).max()
+    assert np.abs(gradient).max() < 1e-6 * scale
+
+
+def test_solve_gains_keeps_isolated_tiles():
+    _, stats = gain_problem()
+    gains = solve_gains(10, stats)
+
+    np.testing.assert_allclose(gains[9], 1.0)
@@ -1,6 +1,7 @@
 # Edits were made to an open source package, Stitch2D, for memory efficiency
 
 """Reads and helps place a single image from a 2D grid"""
+from concurrent.futures import ThreadPoolExecutor
 import logging
 import os
 import re
@@ -14,12 +15,15 @@ if not sys.warnoptions:
 
 import cv2 as cv
 import numpy as np
+from scipy.spatial import cKDTree
 from skimage import io
 from skimage.color import rgb2gray, rgba2rgb
 from skimage.exposure import adjust_gamma
 from skimage.feature import SIFT, match_descriptors
 from skimage.transform import resize
 
+from features import FeatureCache
+
 
 logger = logging.getLogger(__name__)
 
@@ -45,6 +49,76 @@ class _DefaultInstance:
         return self._class(*self._args, **self._kwargs)
 
 
+#: dict : detectors producing binary descriptors, which are matched by Hamming
+#: distance. AKAZE and BRISK moved to opencv-contrib in OpenCV 5, so each
+#: detector is only registered if this build of OpenCV provides it.
+BINARY_DETECTORS = {
+    name: _DefaultInstance(getattr(cv, factory), **kwargs)
+    for name, factory, kwargs in (
+        ("orb", "ORB_create", {"nfeatures": 5000}),
+        ("akaze", "AKAZE_create", {}),
+        ("brisk", "BRISK_create", {}),
+    )
+    if hasattr(cv, factory)
+}
+
+
+def _default_matcher(detector):
+    """Selects the Hamming matcher for binary detectors and FLANN otherwise"""
+    if isinstance(detector, str) and detector in BINARY_DETECTORS:
+        return "bf_hamming"
+    return "flann"
+
+
+def estimate_gamma(im, ref, step=4, iterations=5, limits=(0.2, 5.0)):
+    """Estimates the gamma that matches the mean intensity of an image to a reference
+
+    Starts from the ratio of the logs of the mean intensities and refines
+    it with a few Newton steps on the histogram of the image, so the image
+    itself is never adjusted while searching.
+
+    Parameters
+    ----------
+    im : numpy.ndarray
+        uint8 image data to adjust
+    ref : numpy.ndarray
+        uint8 reference image data
+    step : int
+        sampling interval in pixels in each direction
+    iterations : int
+        maximum number of Newton steps
+    limits : tuple
+        smallest and largest gamma returned
+
+    Returns
+    -------
+    float
+        gamma such that adjust_gamma(im, gamma) has about the mean of ref
+    """
+    counts = np.bincount(np.asarray(im[::step, ::step]).ravel(), minlength=256)
+    if not counts.sum():
+        return 1.0
+    target = np.asarray(ref[::step, ::step]).mean() / 255
+
+    # Black pixels stay black at any gamma, so only the rest are weighted
+    values = np.arange(1, 256) / 255
+    weights = counts[1:256] / counts.sum()
+    mean = (weights * values).sum()
+    if not 0 < mean < 1 or not 0 < target < 1:
+        return 1.0
+
+    gamma = np.clip(np.log(target) / np.log(mean), *limits)
+    for _ in range(iterations):
+        powered = weights * values ** gamma
+        error = powered.sum() - target
+        slope = (powered * np.log(values)).sum()
+        if abs(error) < 1e-4 or slope == 0:
+            break
+        gamma = np.clip(gamma - error / slope, *limits)
+
+    return float(gamma)
+
+
 class Tile:
     """An image tile in a mosaic
 
@@ -75,6 +149,8 @@ class Tile:
         list of descriptors found in this image
     keypoints : numpy.ndarray
         list of coordinates of descriptors found in this image
+    gammas : dict
+        gammas already estimated for intersections with other tiles
     """
 
     #: dict : maps strings to a subclass-specific feature detector
@@ -110,6 +186,7 @@ class Tile:
         self.x = None
 
         self.scale = 1.0
+        self.gammas = {}
 
         self.grid = None
         self.is_placeholder = False
@@ -373,6 +450,7 @@ class Tile:
             "features_detected",
             "descriptors",
             "keypoints",
+            "gammas",
         ):
             setattr(self, attr, getattr(other, attr))
 
@@ -397,18 +475,22 @@ class Tile:
         y1, x1, y2, x2 = box
         return self.imdata.copy()[y1:y2, x1:x2]
 
-    def intersection(self, other):
-        """Finds the intersection between two placed tiles
+    def intersection_bounds(self, other):
+        """Finds the bounds of the intersection between two placed tiles
+
+        Only the positions and sizes of the tiles are used, so no image
+        data is read.
 
         Parameters
         ----------
         other : Tile
-            an adjacent tile that has already been placed in the mosaic
+            another tile that has already been placed in the mosaic
 
         Returns
         -------
-        tuple of Tile
-            the overlapping portion of both tiles
+        tuple
+            bounds of the overlap in the mosaic coordinate system as
+            (y1, x1, y2, x2), or None if the tiles do not intersect
         """
 
         # Based on https://stackoverflow.com/a/25068722
@@ -421,10 +503,28 @@ class Tile:
         x2 = min(max(sx1, sx2), max(ox1, ox2))
 
         if x1 >= x2 or y1 >= y2:
+            return None
+        return y1, x1, y2, x2
+
+    def intersection(self, other):
+        """Finds the intersection between two placed tiles
+
+        Parameters
+        ----------
+        other : Tile
+            an adjacent tile that has already been placed in the mosaic
+
+        Returns
+        -------
+        tuple of Tile
+            the overlapping portion of both tiles
+        """
+        bounds = self.intersection_bounds(other)
+        if bounds is None:
             raise ValueError("Tiles do not intersect")
 
-        xtn1 = self.crop((y1, x1, y2, x2), convert_mosaic_coords=True)
-        xtn2 = other.crop((y1, x1, y2, x2), convert_mosaic_coords=True)
+        xtn1 = self.crop(bounds, convert_mosaic_coords=True)
+        xtn2 = other.crop(bounds, convert_mosaic_coords=True)
 
         return xtn1, xtn2
 
@@ -441,11 +541,7 @@ class Tile:
         bool
             True if tiles intersect, False otherwise
         """
-        try:
-            self.intersection(other)
-            return True
-        except ValueError:
-            return False
+        return self.intersection_bounds(other) is not None
 
     def reset(self):
         """Restores original image and resets coordinate and feature attrs
@@ -474,6 +570,11 @@ class Tile:
     def match_gamma_to(self, other):
         """Scales intensity to match intersecting region of another tile
 
+        Gamma is estimated from a sample of the intersection (see
+        estimate_gamma) and remembered in gammas for the pair and the
+        bounds of their intersection. The gamma is applied to the image data
+        once, so a repeat call for the same pair leaves the tile as it is.
+
         Parameters
         ----------
         other : Tile
@@ -484,37 +585,18 @@ class Tile:
         Tile
             the original tile with its intensity modified
         """
+        bounds = self.intersection_bounds(other)
+        if bounds is None:
+            return self
 
-        def find_gamma(im, other):
-            """Finds gamma that best matches image to a reference image"""
-
-            increment = 0.02
-            if np.mean(im) < np.mean(other):
-                increment *= -1
-
-            gamma = 1
-            gammas = {}
-            while 0 < gamma < 5:
-
-                im_adj = adjust_gamma(im, gamma)
-
-                # Accept when ratio between tiles is within 2%
-                with np.errstate(divide="ignore", invalid="ignore"):
-                    ratio = np.mean(im_adj) / np.mean(other)
-
-                if 0.98 < ratio < 1.02:
-                    return gamma
-
-                # Capture failed values in case no results fall within 2%
-                gammas[abs(1 - ratio)] = gamma
-
-                gamma += increment
-
-            return gammas[min(gammas)]
+        # The image data already has the gamma remembered for the pair
+        key = (other.id, tuple(int(round(b)) for b in bounds))
+        if key in self.gammas:
+            return self
 
         xtn_self, xtn_other = self.intersection(other)
-        gamma = find_gamma(xtn_self, xtn_other)
-        self.imdata = adjust_gamma(self.imdata, gamma)
+        self.gammas[key] = estimate_gamma(xtn_self, xtn_other)
+        self.imdata = adjust_gamma(self.imdata, self.gammas[key])
 
         return self
 
@@ -732,10 +814,10 @@ class Tile:
 
         Parameters
         ----------
-        y : list
-            list of y coordinates
-        x : list
-            list of x coordinates. Same length as y.
+        y : array-like
+            y coordinates
+        x : array-like
+            x coordinates. Same length as y.
         n_pixels : int
             maximum number of pixels coordinate can be from the median
 
@@ -744,18 +826,14 @@ class Tile:
         float
             fraction of coordinates within range in both y and x
         """
+        y = np.asarray(y)
+        x = np.asarray(x)
 
-        min_y = np.median(y) - n_pixels
-        max_y = np.median(y) + n_pixels
-
-        min_x = np.median(x) - n_pixels
-        max_x = np.median(x) + n_pixels
-
-        within = [
-            (y, x) for y, x in zip(y, x) if min_y <= y <= max_y and min_x <= x <= max_x
-        ]
+        within = (np.abs(y - np.median(y)) <= n_pixels) & (
+            np.abs(x - np.median(x)) <= n_pixels
+        )
 
-        return len(within) / len(y)
+        return within.mean()
 
 class MemmapTile:
     """An image tile in a mosaic. Includes necessary logic to store data as np.memmap's.
@@ -784,9 +862,46 @@ class MemmapTile:
     features_detected : bool
         whether any features were detected in this image
     descriptors : numpy.ndarray
-        list of descriptors found in this image
+        descriptors found in this image, stored as uint8 where that is
+        lossless (as for SIFT) and as float16 otherwise
     keypoints : numpy.ndarray
-        list of coordinates of descriptors found in this image
+        float32 array of the keypoints found in this image with one row of
+        (x, y, size, angle) per descriptor
+    prior_y : float
+        the y coordinate of the image predicted from the stage position
+    prior_x : float
+        the x coordinate of the image predicted from the stage position
+    overlap : float
+        fraction of the tile expected to overlap each neighbor. If set,
+        features are only detected in the bands facing its neighbors in the
+        grid.
+    feature_store : FeatureStore
+        if set, keypoints and descriptors are kept in this store instead of
+        on the tile and are mapped back when accessed
+    cache_key : str
+        if set, the features of the tile are stored under this key instead
+        of the tile id. Keys in a FeatureCache let other tiles made from the
+        same frame reuse the features. Keys in other stores only keep copies
+        of a tile apart.
+    plane_path : str
+        path to a single-channel uint8 copy of the image used for alignment.
+        If not set, alignment reads the color image data.
+    plane_shape : tuple
+        shape of the alignment plane as (height, width)
+    plane_scale : float
+        size of the alignment plane relative to the image data
+    flat_field : numpy.ndarray
+        float32 correction with the shape of the image data, multiplied in
+        as it is drawn before the gain, or None if the data is already
+        corrected. Used for frames mapped in place.
+    gain : numpy.ndarray
+        factor for each channel applied to the image data as it is drawn,
+        or None to draw the data as is. See MemmapMosaic.compensate_gains.
+    gamma : float
+        gamma applied to the image data as it is drawn, after the gain, or
+        None to draw the data as is. See match_gamma_to.
+    gammas : dict
+        gammas already estimated for pairs with other tiles
     """
 
     #: dict : maps strings to a subclass-specific feature detector
@@ -795,7 +910,7 @@ class MemmapTile:
     #: dict : maps strings to a subclass-specific feature matcher
     matchers = {}
 
-    def __init__(self, path, shape, detector="sift"):
+    def __init__(self, path, shape, detector="sift", offset=0):
         """Initializes a mosaic from a list of tiles
 
         Parameters
@@ -807,6 +922,10 @@ class MemmapTile:
         detector : str
             name of the detector used to find/extract features. Currently
             only sift is supported.
+        offset : int
+            byte offset of the pixel data within the file at path. Non-zero
+            when the tile maps the pixel strips of an uncompressed TIFF in
+            place instead of a .dat copy.
         """
 
         self.id = uuid.uuid4()
@@ -814,6 +933,7 @@ class MemmapTile:
         self.source = path
         self.path = path
         self.shape = shape
+        self.offset = offset
         # if self.imdata is None:
         #     raise IOError(f"No image data found (source={self.source})")
 
@@ -823,11 +943,27 @@ class MemmapTile:
         self.y = None
         self.x = None
 
+        self.prior_y = None
+        self.prior_x = None
+
+        self.overlap = None
+
+        self.plane_path = None
+        self.plane_shape = None
+        self.plane_scale = 1.0
+
+        self.flat_field = None
+        self.gain = None
+        self.gamma = None
+        self.gammas = {}
+
         self.scale = 1.0
 
         self.grid = None
         self.is_placeholder = False
 
+        self.feature_store = None
+        self.cache_key = None
         self.features_detected = None
         self.descriptors = None
         self.keypoints = None
@@ -937,13 +1073,111 @@ class MemmapTile:
     @property
     def dtype(self):
         """Gets the dtype of the image"""
-        return self.imdata.dtype
+        return self.get_imdata().dtype
+
+    @property
+    def owns_features(self):
+        """Whether features in the feature store are only used by this tile
+
+        Features in a FeatureCache are kept for later stitches and other
+        tiles made from the same frame, so they are never deleted by a tile.
+        """
+        return self.feature_store is not None and not isinstance(
+            self.feature_store, FeatureCache
+        )
+
+    @property
+    def feature_key(self):
+        """Gets the key of the features of this tile in the feature store"""
+        return self.cache_key if self.cache_key is not None else self.id
+
+    @property
+    def features_stored(self):
+        """Whether the feature store holds the result of a search for features, even if none were found"""
+        return self.feature_store is not None and self.feature_store.contains(self.feature_key)
+
+    @property
+    def keypoints(self):
+        """Gets the keypoints, mapped from the feature store if the tile uses one"""
+        if self._keypoints is None and self.feature_store is not None:
+            return self.feature_store.load(self.feature_key, "keypoints")
+        return self._keypoints
+
+    @keypoints.setter
+    def keypoints(self, val):
+        self._keypoints = val
+
+    @property
+    def descriptors(self):
+        """Gets the descriptors, mapped from the feature store if the tile uses one"""
+        if self._descriptors is None and self.feature_store is not None:
+            descriptors = self.feature_store.load(self.feature_key, "descriptors")
+            # An empty entry records that no features were found
+            return descriptors if descriptors is not None and descriptors.size else None
+        return self._descriptors
+
+    @descriptors.setter
+    def descriptors(self, val):
+        self._descriptors = val
 
     @property
     def placed(self):
         """Whether the tile has been assigned coordinates in the mosaic"""
         return self.y is not None and self.x is not None
 
+    @property
+    def has_prior(self):
+        """Whether the tile has a position predicted from the stage coordinates"""
+        return self.prior_y is not None and self.prior_x is not None
+
+    def place_from_prior(self, other):
+        """Places tile relative to another, already placed tile using the stage priors
+
+        Parameters
+        ----------
+        other : Tile
+            a tile that has already been placed in the mosaic
+
+        Returns
+        -------
+        Tile
+            the original tile updated with x and y coordinates
+        """
+        self.y = other.y + self.prior_y - other.prior_y
+        self.x = other.x + self.prior_x - other.prior_x
+        return self
+
+    def expected_offset(self, other):
+        """Predicts the position of this tile relative to another tile
+
+        Uses the stage priors if both tiles have them. Otherwise, adjacent
+        tiles are assumed to be one step apart in the direction given by
+        their rows and columns, with the step set by the overlap.
+
+        Parameters
+        ----------
+        other : Tile
+            another tile in the mosaic
+
+        Returns
+        -------
+        tuple
+            expected offset as (dy, dx) such that this tile sits at
+            other.y + dy, other.x + dx, or None if it can't be predicted
+        """
+        if self.has_prior and other.has_prior:
+            return self.prior_y - other.prior_y, self.prior_x - other.prior_x
+
+        if self.overlap is None or None in (self.row, self.col, other.row, other.col):
+            return None
+
+        d_row = self.row - other.row
+        d_col = self.col - other.col
+        if abs(d_row) + abs(d_col) != 1:
+            return None
+
+        return d_row * self.height * (1 - self.overlap), d_col * self.width * (1 - self.overlap)
+
     def load_imdata(self):
         """Loads copy of source data
 
@@ -957,8 +1191,21 @@ class MemmapTile:
         raise ValueError("Data must be a numpy array")
 
     def get_imdata(self):
-        """Loads the data from the memmap path"""
-        return np.memmap(self.path, dtype='uint8', mode='r', shape=(self.shape[0], self.shape[1], self.shape[2]))
+        """Loads the data from the memmap path as a read-only view"""
+        return np.memmap(self.path, dtype='uint8', mode='r', offset=self.offset, shape=(self.shape[0], self.shape[1], self.shape[2]))
+
+    def get_aligndata(self):
+        """Loads the image used for alignment as a read-only view
+
+        Returns
+        -------
+        numpy.memmap
+            the single-channel alignment plane at plane_scale if the tile has
+            one, otherwise the color image data
+        """
+        if self.plane_path is None:
+            return self.get_imdata()
+        return np.memmap(self.plane_path, dtype='uint8', mode='r', shape=tuple(self.plane_shape))
     
     def bounds(self, as_int=False):
         """Calculates the position of the tile within the mosaic
@@ -1009,6 +1256,52 @@ class MemmapTile:
 
         return neighbors
 
+    def overlap_regions(self, margin=0.05):
+        """Calculates the regions of the tile expected to overlap its neighbors
+
+        Parameters
+        ----------
+        margin : float
+            extra fraction of the tile added to each band to allow for
+            error in the stage position
+
+        Returns
+        -------
+        list of tuple
+            non-overlapping regions as (y1, x1, y2, x2) in tile coordinates.
+            The full tile is returned if overlap is not set or the bands
+            cover the whole tile anyway.
+        """
+        full = [(0, 0, self.height, self.width)]
+        if self.overlap is None or self.grid is None:
+            return full
+
+        neighbors = self.neighbors()
+        band_h = int(min(self.overlap + margin, 1) * self.height)
+        band_w = int(min(self.overlap + margin, 1) * self.width)
+
+        # Top and bottom bands span the full width, so the left and right
+        # bands only need to cover the rows between them
+        y1 = band_h if "top" in neighbors else 0
+        y2 = self.height - band_h if "bottom" in neighbors else self.height
+
+        regions = []
+        if "top" in neighbors:
+            regions.append((0, 0, min(band_h, self.height), self.width))
+        if "bottom" in neighbors:
+            regions.append((max(self.height - band_h, y1), 0, self.height, self.width))
+        if y1 < y2:
+            if "left" in neighbors:
+                regions.append((y1, 0, y2, band_w))
+            if "right" in neighbors:
+                regions.append((y1, max(self.width - band_w, band_w if "left" in neighbors else 0), y2, self.width))
+
+        area = sum((b[2] - b[0]) * (b[3] - b[1]) for b in regions)
+        if not regions or area >= self.height * self.width:
+            return full
+
+        return regions
+
     def convert_mosaic_coords(self, y1, x1, y2, x2):
         """Converts mosaic coordinates to image coordinates
 
@@ -1027,7 +1320,7 @@ class MemmapTile:
         other : Tile
             a tile with attributes to copy over to this one
         """
-        for attr in (
+        attrs = [
             # "imdata",
             "source",
             "row",
@@ -1036,24 +1329,103 @@ class MemmapTile:
             "x",
             "scale",
             "features_detected",
-            "descriptors",
-            "keypoints",
-        ):
+            "gamma",
+            "gammas",
+        ]
+
+        # Features in a feature store are mapped from there instead of copied
+        if other.feature_store is None:
+            attrs.extend(["descriptors", "keypoints"])
+
+        for attr in attrs:
             setattr(self, attr, getattr(other, attr))
 
+    def set_features(self, keypoints, descriptors):
+        """Keeps detected features, writing them to the feature store if the tile uses one
 
-    def intersection(self, other):
-        """Finds the intersection between two placed tiles
+        Parameters
+        ----------
+        keypoints : numpy.ndarray
+            keypoints found in this image
+        descriptors : numpy.ndarray
+            descriptors found in this image
+
+        Returns
+        -------
+        MemmapTile
+            the original tile updated with features and keypoints
+        """
+        if self.feature_store is not None:
+            # Store empty features too, so a search that found nothing is not repeated
+            if descriptors is None:
+                keypoints = np.empty((0, 4), dtype=np.float32)
+                descriptors = np.empty((0, 0), dtype=np.uint8)
+            self.feature_store.save(self.feature_key, keypoints, descriptors)
+            keypoints = None
+            descriptors = None
+        self.keypoints = keypoints
+        self.descriptors = descriptors
+        return self
+
+    def clear_features(self):
+        """Frees the features of the tile while keeping it marked as detected
+
+        Returns
+        -------
+        MemmapTile
+            the original tile with empty keypoints and descriptors
+        """
+        keypoints = self.keypoints
+        descriptors = self.descriptors
+        if descriptors is not None:
+            self.keypoints = np.array(keypoints[:0])
+            self.descriptors = np.array(descriptors[:0])
+        if self.owns_features:
+            self.feature_store.delete(self.feature_key)
+        return self
+
+    def spill_features(self, store=None):
+        """Moves features held in memory to a feature store
+
+        Parameters
+        ----------
+        store : FeatureStore
+            store to move the features to. If not given, the features are
+            freed and the tile is marked for detection again.
+
+        Returns
+        -------
+        bool
+            whether features were moved out of memory
+        """
+        if self.feature_store is not None or self._descriptors is None or not len(self._descriptors):
+            return False
+        if store is None:
+            self.keypoints = None
+            self.descriptors = None
+            self.features_detected = None
+        else:
+            self.feature_store = store
+            self.set_features(self._keypoints, self._descriptors)
+        return True
+
+
+    def intersection_bounds(self, other):
+        """Finds the bounds of the intersection between two placed tiles
+
+        Only the positions and sizes of the tiles are used, so no image
+        data is read.
 
         Parameters
         ----------
         other : Tile
-            an adjacent tile that has already been placed in the mosaic
+            another tile that has already been placed in the mosaic
 
         Returns
         -------
-        tuple of Tile
-            the overlapping portion of both tiles
+        tuple
+            bounds of the overlap in the mosaic coordinate system as
+            (y1, x1, y2, x2), or None if the tiles do not intersect
         """
 
         # Based on https://stackoverflow.com/a/25068722
@@ -1066,10 +1438,28 @@ class MemmapTile:
         x2 = min(max(sx1, sx2), max(ox1, ox2))
 
         if x1 >= x2 or y1 >= y2:
+            return None
+        return y1, x1, y2, x2
+
+    def intersection(self, other):
+        """Finds the intersection between two placed tiles
+
+        Parameters
+        ----------
+        other : Tile
+            an adjacent tile that has already been placed in the mosaic
+
+        Returns
+        -------
+        tuple of Tile
+            the overlapping portion of both tiles
+        """
+        bounds = self.intersection_bounds(other)
+        if bounds is None:
             raise ValueError("Tiles do not intersect")
 
-        xtn1 = self.crop((y1, x1, y2, x2), convert_mosaic_coords=True)
-        xtn2 = other.crop((y1, x1, y2, x2), convert_mosaic_coords=True)
+        xtn1 = self.crop(bounds, convert_mosaic_coords=True)
+        xtn2 = other.crop(bounds, convert_mosaic_coords=True)
 
         return xtn1, xtn2
 
@@ -1086,11 +1476,51 @@ class MemmapTile:
         bool
             True if tiles intersect, False otherwise
         """
-        try:
-            self.intersection(other)
-            return True
-        except ValueError:
-            return False
+        return self.intersection_bounds(other) is not None
+
+    def overlap_means(self, other, step=8):
+        """Measures the mean intensity of both tiles where they overlap
+
+        The overlap is sampled every step pixels in each direction, so only
+        a small fraction of it is read.
+
+        Parameters
+        ----------
+        other : Tile
+            an adjacent tile that has already been placed in the mosaic
+        step : int
+            sampling interval in pixels
+
+        Returns
+        -------
+        tuple
+            mean of each channel in this tile and in the other tile, and
+            the number of pixels sampled, or None if the tiles do not
+            intersect
+        """
+        bounds = self.intersection_bounds(other)
+        if bounds is None:
+            return None
+
+        y1, x1, y2, x2 = [int(round(b)) for b in bounds]
+        samples = []
+        for tile in (self, other):
+            ty = int(round(tile.y))
+            tx = int(round(tile.x))
+            rows = slice(y1 - ty, y2 - ty, step)
+            cols = slice(x1 - tx, x2 - tx, step)
+            samples.append(tile.flatten(tile.get_imdata()[rows, cols], rows, cols))
+
+        # Tiles can disagree on the size of the overlap by a pixel after rounding
+        height = min(s.shape[0] for s in samples)
+        width = min(s.shape[1] for s in samples)
+        if not height or not width:
+            return None
+
+        means = [
+            s[:height, :width].reshape(-1, s.shape[-1]).mean(axis=0) for s in samples
+        ]
+        return means[0], means[1], height * width
 
     def reset(self):
         """Restores original image and resets coordinate and feature attrs
@@ -1113,12 +1543,20 @@ class MemmapTile:
         self.features_detected = None
         self.descriptors = None
         self.keypoints = None
+        if self.owns_features:
+            self.feature_store.delete(self.feature_key)
 
         return self
 
     def match_gamma_to(self, other):
         """Scales intensity to match intersecting region of another tile
 
+        Gamma is estimated from a sample of the intersection (see
+        estimate_gamma) and kept on the tile to be applied as the mosaic is
+        drawn, so the image data is never rewritten. The reference is the
+        other tile as it will be drawn. Results are remembered for each pair
+        in gammas.
+
         Parameters
         ----------
         other : Tile
@@ -1127,51 +1565,118 @@ class MemmapTile:
         Returns
         -------
         Tile
-            the original tile with its intensity modified
+            the original tile with its gamma set
         """
+        bounds = self.intersection_bounds(other)
+        if bounds is None:
+            return self
 
-        def find_gamma(im, other):
-            """Finds gamma that best matches image to a reference image"""
-
-            increment = 0.02
-            if np.mean(im) < np.mean(other):
-                increment *= -1
-
-            gamma = 1
-            gammas = {}
-            while 0 < gamma < 5:
+        # The estimate depends on the gains of both tiles and the gamma of
+        # the other tile, so a change to any of them estimates it again
+        gains = tuple(
+            None if tile.gain is None else tuple(np.ravel(tile.gain))
+            for tile in (self, other)
+        )
+        key = (other.id, tuple(int(round(b)) for b in bounds), other.gamma, gains)
+        if key not in self.gammas:
+            y1, x1, y2, x2 = key[1]
+            samples = []
+            for tile in (self, other):
+                ty = int(round(tile.y))
+                tx = int(round(tile.x))
+                rows = slice(y1 - ty, y2 - ty, 4)
+                cols = slice(x1 - tx, x2 - tx, 4)
+                samples.append((tile.get_imdata()[rows, cols], rows, cols))
+
+            gamma = self.gamma
+            self.gamma = None
+            try:
+                im = self.correct(*samples[0])
+            finally:
+                self.gamma = gamma
+            self.gammas[key] = estimate_gamma(im, other.correct(*samples[1]), step=1)
 
-                im_adj = adjust_gamma(im, gamma)
+        self.gamma = self.gammas[key]
 
-                # Accept when ratio between tiles is within 2%
-                with np.errstate(divide="ignore", invalid="ignore"):
-                    ratio = np.mean(im_adj) / np.mean(other)
+        return self
 
-                if 0.98 < ratio < 1.02:
-                    return gamma
+    def flatten(self, imdata, rows=slice(None), cols=slice(None)):
+        """Applies the flat-field correction of the tile to image data
 
-                # Capture failed values in case no results fall within 2%
-                gammas[abs(1 - ratio)] = gamma
+        Parameters
+        ----------
+        imdata : numpy.ndarray
+            uint8 image data from this tile
+        rows, cols : slice
+            rows and columns of the tile the data was read from
 
-                gamma += increment
+        Returns
+        -------
+        numpy.ndarray
+            corrected uint8 image data, or the original data if the tile
+            has no flat field
+        """
+        if self.flat_field is None:
+            return imdata
+        return np.clip(imdata * self.flat_field[rows, cols], 0, 255).astype(np.uint8)
 
-            return gammas[min(gammas)]
+    def correct(self, imdata, rows=slice(None), cols=slice(None)):
+        """Applies the flat field, gain and gamma of the tile to image data
 
-        xtn_self, xtn_other = self.intersection(other)
-        gamma = find_gamma(xtn_self, xtn_other)
-        self.imdata = adjust_gamma(self.imdata, gamma)
+        Parameters
+        ----------
+        imdata : numpy.ndarray
+            uint8 image data from this tile
+        rows, cols : slice
+            rows and columns of the tile the data was read from
 
-        return self
+        Returns
+        -------
+        numpy.ndarray
+            corrected uint8 image data, or the original data if the tile
+            has no corrections
+        """
+        imdata = self.flatten(imdata, rows, cols)
+        if self.gain is not None:
+            imdata = np.clip(imdata * np.float32(self.gain), 0, 255).astype(np.uint8)
+        if self.gamma is not None:
+            imdata = adjust_gamma(imdata, self.gamma)
+        return imdata
 
 
-    def draw_memmap(self, others=None, path=None):
+    def draw_memmap(
+        self, others=None, path=None, cells=False, band_height=512, workers=1, max_memory=None
+    ):
         """Creates an image from the provided tiles and stores in a memmap/bigtiff
 
+        The image is drawn in bands of rows. Each band is assembled in memory
+        from the tiles that intersect it and written to the memmap in one
+        sequential write, so drawing is limited by disk bandwidth rather
+        than by seeking. Bands are disjoint, so they are drawn in parallel.
+        The gain and gamma of each tile, if set, are applied as its data is
+        copied into a band.
+
         Parameters
         ----------
         others : list of Tiles
             a list of tiles to include in the new image. Only tiles that
             have been placed will be included.
+        path : str
+            path to the memmap
+        cells : bool
+            whether each tile only draws its own cell, the pixels closer to
+            its center than to the center of any other tile covering them.
+            Each pixel is then written once and only the bounding box of the
+            cell is read from each tile. Otherwise full tiles are drawn and
+            the last tile drawn wins where they overlap.
+        band_height : int
+            height of a band in pixels
+        workers : int
+            number of threads drawing bands at the same time
+        max_memory : int
+            maximum number of bytes held in bands at once. Bands are made
+            shorter and fewer are drawn at once to fit. Unlimited if not
+            given.
 
         Returns
         -------
@@ -1205,20 +1710,131 @@ class MemmapTile:
 
         # Sort placeholders to front of list so they're drawn first. Tiles
         # with image data will then overwrite them where they overlap.
-        tiles = [t for t in [self] + others if t.is_placeholder]
-        tiles.extend([t for t in [self] + others if not t.is_placeholder])
+        tiles = [t for t in tiles if t.is_placeholder] + [
+            t for t in tiles if not t.is_placeholder
+        ]
+        boxes = np.array(
+            [
+                (
+                    int(t.y - min(ys)),
+                    int(t.x - min(xs)),
+                    int(t.y - min(ys)) + t.height,
+                    int(t.x - min(xs)) + t.width,
+                )
+                for t in tiles
+            ]
+        ).reshape(-1, 4)
+
+        # Placeholders are only drawn where no tile has image data
+        drawn = [i for i, t in enumerate(tiles) if not t.is_placeholder]
+        drawn_boxes = boxes[drawn]
+        order = {i: n for n, i in enumerate(drawn)}
+
+        # Fit the bands held at once under the memory cap
+        row_bytes = width * shape_tuple[2] * data.itemsize
+        if max_memory is not None:
+            band_height = max(1, min(band_height, int(max_memory // row_bytes)))
+            workers = max(1, min(workers, int(max_memory // (band_height * row_bytes))))
+
+        def draw_band(top):
+            bottom = min(top + band_height, height)
+            band = np.zeros((bottom - top, width, shape_tuple[2]), dtype=data.dtype)
+
+            within = np.flatnonzero((boxes[:, 0] < bottom) & (boxes[:, 2] > top))
+            for i in within:
+                tile = tiles[i]
+                y1, x1, y2, x2 = boxes[i]
+                r1, r2 = max(y1, top), min(y2, bottom)
+
+                if cells and not tile.is_placeholder:
+                    mask = self._cell_mask(drawn_boxes, order[i], r1, r2)
+                    cols = np.flatnonzero(mask.any(axis=0))
+                    if not len(cols):
+                        continue
+                    c1, c2 = cols[0], cols[-1] + 1
+                    mask = mask[:, c1:c2]
+                else:
+                    c1, c2 = 0, x2 - x1
+                    mask = None
+
+                rows = slice(r1 - y1, r2 - y1)
+                imdata = tile.get_imdata()[rows, c1:c2]
+                if not tile.is_placeholder:
+                    imdata = tile.correct(imdata, rows, slice(c1, c2))
+                out = band[r1 - top : r2 - top, x1 + c1 : x1 + c2]
+                if mask is None or mask.all():
+                    out[:] = imdata
+                else:
+                    np.copyto(out, imdata, casting="unsafe", where=mask[..., None])
+
+            data[top:bottom] = band
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for _ in executor.map(draw_band, range(0, height, band_height)):
+                pass
+
+        data.flush()
+        del data 
 
-        for tile in tiles:
-            y = int(tile.y - min(ys))
-            x = int(tile.x - min(xs))
+        return shape
 
-            data[y : y + tile.height, x : x + tile.width] = tile.get_imdata()
-            # del tile.imdata
+    @staticmethod
+    def _cell_mask(boxes, index, top=None, bottom=None):
+        """Finds the pixels of a tile that belong to its cell
 
+        A pixel belongs to the covering tile whose center is nearest, with
+        ties going to the tile listed first, so the cells of the tiles
+        cover the mosaic without overlapping. Between two neighbors in a
+        grid, the boundary is the midline of their overlap.
 
-        del data 
+        Parameters
+        ----------
+        boxes : numpy.ndarray
+            bounds of every tile drawn as rows of (y1, x1, y2, x2) in pixels
+        index : int
+            index of the tile in boxes
+        top : int
+            first row of the mosaic to include. Defaults to the top of the
+            tile.
+        bottom : int
+            row of the mosaic after the last row to include. Defaults to the
+            bottom of the tile.
 
-        return shape
+        Returns
+        -------
+        numpy.ndarray
+            boolean mask of the included rows of the tile
+        """
+        y1, x1, y2, x2 = boxes[index]
+        cy = (y1 + y2) / 2
+        cx = (x1 + x2) / 2
+        y1 = y1 if top is None else max(y1, top)
+        y2 = y2 if bottom is None else min(y2, bottom)
+        mask = np.ones((max(y2 - y1, 0), x2 - x1), dtype=bool)
+
+        overlaps = (
+            (boxes[:, 0] < y2) & (boxes[:, 2] > y1) & (boxes[:, 1] < x2) & (boxes[:, 3] > x1)
+        )
+        overlaps[index] = False
+
+        for other in np.flatnonzero(overlaps):
+            oy1, ox1, oy2, ox2 = boxes[other]
+            oy = (oy1 + oy2) / 2
+            ox = (ox1 + ox2) / 2
+
+            # Only pixels in the overlap are contested. A pixel at (py, px)
+            # is nearer this center if 2py(oy - cy) + 2px(ox - cx) is less
+            # than oy^2 + ox^2 - cy^2 - cx^2.
+            upper, lower = max(y1, oy1), min(y2, oy2)
+            left, right = max(x1, ox1), min(x2, ox2)
+            py = np.arange(upper, lower) + 0.5
+            px = np.arange(left, right) + 0.5
+            lhs = (2 * (oy - cy) * py)[:, None] + (2 * (ox - cx) * px)[None, :]
+            rhs = oy ** 2 + ox ** 2 - cy ** 2 - cx ** 2
+            nearer = lhs <= rhs if index < other else lhs < rhs
+            mask[upper - y1 : lower - y1, left - x1 : right - x1] &= nearer
+
+        return mask
 
     def save(self, path, others=None):
         """Saves an image created from the provided tiles
@@ -1385,10 +2001,10 @@ class MemmapTile:
 
         Parameters
         ----------
-        y : list
-            list of y coordinates
-        x : list
-            list of x coordinates. Same length as y.
+        y : array-like
+            y coordinates
+        x : array-like
+            x coordinates. Same length as y.
         n_pixels : int
             maximum number of pixels coordinate can be from the median
 
@@ -1397,18 +2013,14 @@ class MemmapTile:
         float
             fraction of coordinates within range in both y and x
         """
+        y = np.asarray(y)
+        x = np.asarray(x)
 
-        min_y = np.median(y) - n_pixels
-        max_y = np.median(y) + n_pixels
-
-        min_x = np.median(x) - n_pixels
-        max_x = np.median(x) + n_pixels
-
-        within = [
-            (y, x) for y, x in zip(y, x) if min_y <= y <= max_y and min_x <= x <= max_x
-        ]
+        within = (np.abs(y - np.median(y)) <= n_pixels) & (
+            np.abs(x - np.median(x)) <= n_pixels
+        )
 
-        return len(within) / len(y)
+        return within.mean()
 
 class OpenCVTile(Tile):
     """An image tile in a mosaic loaded and manipulated using OpenCV
@@ -1416,21 +2028,22 @@ class OpenCVTile(Tile):
     See Tile for available attributes.
     """
 
-    detectors = {"sift": _DefaultInstance(cv.SIFT_create)}
+    detectors = {"sift": _DefaultInstance(cv.SIFT_create), **BINARY_DETECTORS}
 
     matchers = {
         "bf": _DefaultInstance(cv.BFMatcher),
+        "bf_hamming": _DefaultInstance(cv.BFMatcher, cv.NORM_HAMMING),
         "flann": _DefaultInstance(
             cv.FlannBasedMatcher, {"algorithm": 1, "trees": 5}, {"checks": 50}
         ),
     }
 
-    def __init__(self, data, detector="sift", matcher="flann"):
+    def __init__(self, data, detector="sift", matcher=None):
         super().__init__(data)
 
         self.channel_order = "BGR"
         self._detector = detector
-        self._matcher = matcher
+        self._matcher = matcher if matcher is not None else _default_matcher(detector)
 
     def load_imdata(self):
         """Loads copy of source data
@@ -1633,25 +2246,37 @@ class MemmapOpenCVTile(MemmapTile):
     See Tile for available attributes.
     """
 
-    detectors = {"sift": _DefaultInstance(cv.SIFT_create)}
+    #: float : search radius for constrained matching as a fraction of the tile size, used when no window is given
+    search_radius = 0.05
+
+    #: int : fewest matches that agree on an offset for it to be accepted
+    min_matches = 10
+
+    detectors = {"sift": _DefaultInstance(cv.SIFT_create), **BINARY_DETECTORS}
 
     matchers = {
         "bf": _DefaultInstance(cv.BFMatcher),
+        "bf_hamming": _DefaultInstance(cv.BFMatcher, cv.NORM_HAMMING),
         "flann": _DefaultInstance(
             cv.FlannBasedMatcher, {"algorithm": 1, "trees": 5}, {"checks": 50}
         ),
     }
 
-    def __init__(self, path, shape, detector="sift", matcher="flann"):
-        super().__init__(path, shape)
+    def __init__(self, path, shape, detector="sift", matcher=None, offset=0):
+        super().__init__(path, shape, offset=offset)
 
         self.channel_order = "BGR"
         self._detector = detector
-        self._matcher = matcher
+        self._matcher = matcher if matcher is not None else _default_matcher(detector)
+
+    @property
+    def binary(self):
+        """Tests if the detector produces binary descriptors compared by Hamming distance"""
+        return isinstance(self._detector, str) and self._detector in BINARY_DETECTORS
 
     def refresh_memmap(self):
         del self.imdata
-        self.imdata = np.memmap(self.path, dtype=np.uint8, mode='r', shape=(self.shape[0], self.shape[1], self.shape[2]))
+        self.imdata = np.memmap(self.path, dtype=np.uint8, mode='r', offset=self.offset, shape=(self.shape[0], self.shape[1], self.shape[2]))
 
     def load_imdata(self):
         """Loads copy of source data
@@ -1775,57 +2400,321 @@ class MemmapOpenCVTile(MemmapTile):
 
         if self.features_detected is None:
 
+            # Reuse features detected earlier, for example by FeatureCacheFiller
+            if self.features_stored:
+                self.features_detected = self.descriptors is not None
+                return self
+
             try:
-                detected = self.detector.detectAndCompute(self.get_imdata(), None)
+                detected = self._detect_in_regions(self.get_aligndata(), self.overlap_regions(), self.plane_scale)
             except KeyError:
                 self.features_detected = False
             else:
-                self.keypoints, self.descriptors = detected
-                self.features_detected = self.descriptors is not None
+                keypoints, descriptors = detected
+                self.set_features(keypoints, descriptors)
+                self.features_detected = descriptors is not None
             # finally:
             #     # delete the each time as a blanket fix 
             #     self.refresh_memmap()
 
         return self
 
-    def align_to(self, other, **kwargs):
-        """Aligns tile to another, already placed tile
+    def _detect_in_regions(self, imdata, regions, scale=1.0):
+        """Detects features in each region, offsetting keypoints back into tile coordinates
+
+        Parameters
+        ----------
+        imdata : numpy.ndarray
+            image data
+        regions : list of tuple
+            regions to search as (y1, x1, y2, x2) in tile coordinates
+        scale : float
+            size of imdata relative to the tile. Regions are scaled to match
+            and keypoints are scaled back to tile coordinates.
+
+        Returns
+        -------
+        tuple
+            keypoints as an array of (x, y, size, angle) and descriptors
+            found in all regions
+        """
+        detector = self.detector
+        keypoints = []
+        descriptors = []
+        for y1, x1, y2, x2 in regions:
+            y1, x1 = int(y1 * scale), int(x1 * scale)
+            y2, x2 = int(np.ceil(y2 * scale)), int(np.ceil(x2 * scale))
+            kps, descs = detector.detectAndCompute(imdata[y1:y2, x1:x2], None)
+            if descs is None:
+                continue
+            keypoints.append(
+                np.float32([(kp.pt[0] + x1, kp.pt[1] + y1, kp.size, kp.angle) for kp in kps])
+            )
+            descriptors.append(descs)
+
+        if not descriptors:
+            return np.empty((0, 4), dtype=np.float32), None
+
+        keypoints = np.vstack(keypoints)
+        if scale != 1.0:
+            keypoints[:, :3] /= scale
+        return keypoints, self._compact_descriptors(np.vstack(descriptors))
+
+    @staticmethod
+    def _compact_descriptors(descriptors):
+        """Stores descriptors in the smallest type that keeps them usable for matching
+
+        Parameters
+        ----------
+        descriptors : numpy.ndarray
+            descriptors returned by the detector
+
+        Returns
+        -------
+        numpy.ndarray
+            descriptors as uint8 if they are whole numbers from 0 to 255 (as
+            for SIFT or binary descriptors), otherwise as float16
+        """
+        if descriptors.dtype == np.uint8:
+            return descriptors
+        if descriptors.min() >= 0 and descriptors.max() <= 255 and not np.any(descriptors % 1):
+            return descriptors.astype(np.uint8)
+        return descriptors.astype(np.float16)
+
+    def estimate_offset(self, other, window=None, constrained=True, **kwargs):
+        """Estimates the position of this tile relative to another tile
 
         Parameters
         ----------
         other : Tile
-            a tile that has already been placed in the mosaic
+            a tile with detected features
+        window : float
+            if given and both tiles have stage priors, only matches that put
+            the tile within this many pixels of the position predicted by the
+            priors are used
+        constrained : bool
+            whether to only match keypoints near where they are predicted to
+            land in the other tile when the offset can be predicted. See
+            expected_offset.
+        **kwargs :
+            any keyword argument accepted by the knnMatch method on the matcher
 
         Returns
         -------
-        OpenCVTile
-            the original tile updated with x and y coordinates
+        tuple
+            offset as (dy, dx) such that this tile sits at other.y + dy,
+            other.x + dx, or None if the tiles could not be matched
         """
 
-        if self.features_detected and other.features_detected:
+        if not (self.features_detected and other.features_detected):
+            return None
 
-            kwargs.setdefault("k", 2)
-            matches = self.matcher.knnMatch(
-                self.descriptors, other.descriptors, **kwargs
+        expected = self.expected_offset(other) if constrained else None
+        if expected is not None:
+            radius = window if window is not None else self.search_radius * max(self.height, self.width)
+            dy, dx = self._match_nearby(other, expected, radius)
+
+            # The prediction can be off by more than the spacing of the
+            # keypoints, leaving the true matches outside the candidates
+            if len(dy) < self.min_matches:
+                dy, dx = self._match_all(other, **kwargs)
+
+        else:
+            dy, dx = self._match_all(other, **kwargs)
+
+        # Only search within the window around the stage-predicted offset
+        if window is not None and self.has_prior and other.has_prior:
+            expected_dy = self.prior_y - other.prior_y
+            expected_dx = self.prior_x - other.prior_x
+            within = (np.abs(dy - expected_dy) <= window) & (np.abs(dx - expected_dx) <= window)
+            dy = dy[within]
+            dx = dx[within]
+
+        if len(dy) >= self.min_matches and self._within_n_pixels(dy, dx, 5) > 0.5:
+            return float(np.median(dy)), float(np.median(dx))
+
+        return None
+
+    def _match_all(self, other, **kwargs):
+        """Matches every keypoint against every keypoint of the other tile
+
+        Parameters
+        ----------
+        other : Tile
+            a tile with detected features
+        **kwargs :
+            any keyword argument accepted by the knnMatch method on the matcher
+
+        Returns
+        -------
+        tuple of numpy.ndarray
+            tile offsets in y and x implied by each match
+        """
+        kwargs.setdefault("k", 2)
+        descriptors = self.descriptors
+        other_descriptors = other.descriptors
+        if not self.binary:
+            descriptors = np.float32(descriptors)
+            other_descriptors = np.float32(other_descriptors)
+        matches = self.matcher.knnMatch(descriptors, other_descriptors, **kwargs)
+
+        # Ratios from OpenCV Stitcher docs
+        matches = np.array(
+            [(m.queryIdx, m.trainIdx) for m, n in matches if m.distance < 0.65 * n.distance],
+            dtype=int,
+        ).reshape(-1, 2)
+
+        keypoints = self.keypoints[matches[:, 0]]
+        other_keypoints = other.keypoints[matches[:, 1]]
+        dy = other_keypoints[:, 1] - keypoints[:, 1]
+        dx = other_keypoints[:, 0] - keypoints[:, 0]
+        return dy, dx
+
+    def _match_nearby(self, other, expected, radius, k=8, max_k=64, chunk_size=4096):
+        """Matches keypoints only against keypoints near their predicted position in the other tile
+
+        Keypoints outside the predicted overlap are dropped, and each
+        remaining keypoint is compared with the keypoints of the other tile
+        found within radius of where the expected offset puts it. The number
+        of candidates follows the number of keypoints expected within the
+        radius, between k and max_k, so dense overlaps still reach the whole
+        radius. This keeps matching close to linear in the number of
+        keypoints.
+
+        Parameters
+        ----------
+        other : Tile
+            a tile with detected features
+        expected : tuple
+            expected offset as (dy, dx). See expected_offset.
+        radius : float
+            maximum distance in pixels from the predicted position
+        k : int
+            minimum number of candidates compared with each keypoint
+        max_k : int
+            maximum number of candidates compared with each keypoint
+        chunk_size : int
+            number of keypoints whose candidates are compared at once
+
+        Returns
+        -------
+        tuple of numpy.ndarray
+            tile offsets in y and x implied by each match
+        """
+        ey, ex = expected
+        pts_self = self.keypoints[:, :2]
+        pts_other = other.keypoints[:, :2]
+
+        # Keep only keypoints inside the predicted overlap, padded by the radius
+        query_idx = np.flatnonzero(
+            (pts_self[:, 0] >= -ex - radius)
+            & (pts_self[:, 0] < other.width - ex + radius)
+            & (pts_self[:, 1] >= -ey - radius)
+            & (pts_self[:, 1] < other.height - ey + radius)
+        )
+        train_idx = np.flatnonzero(
+            (pts_other[:, 0] >= ex - radius)
+            & (pts_other[:, 0] < self.width + ex + radius)
+            & (pts_other[:, 1] >= ey - radius)
+            & (pts_other[:, 1] < self.height + ey + radius)
+        )
+        if not len(query_idx) or len(train_idx) < 2:
+            return np.empty(0, dtype=np.float32), np.empty(0, dtype=np.float32)
+
+        # Candidates within the radius, from the density of keypoints in the
+        # part of the other tile searched
+        height = min(self.height + ey + radius, other.height) - max(ey - radius, 0)
+        width = min(self.width + ex + radius, other.width) - max(ex - radius, 0)
+        density = len(train_idx) / max(height * width, 1.0)
+        k = int(np.clip(np.ceil(1.5 * density * np.pi * radius ** 2), k, max_k))
+
+        tree = cKDTree(pts_other[train_idx])
+        k = min(k, len(train_idx))
+        predicted = pts_self[query_idx] + np.float32([ex, ey])
+        _, nearby = tree.query(predicted, k=k, distance_upper_bound=radius)
+
+        descriptors = self.descriptors
+        train_descriptors = other.descriptors[train_idx]
+        matched_query = []
+        matched_train = []
+        for i in range(0, len(query_idx), chunk_size):
+            queries = query_idx[i:i + chunk_size]
+            candidates = nearby[i:i + chunk_size]
+
+            # Missing neighbors are returned with an index equal to the number of points
+            valid = candidates < len(train_idx)
+            candidates = np.where(valid, candidates, 0)
+            dist = self._descriptor_distances(
+                descriptors[queries], train_descriptors[candidates], binary=self.binary
             )
+            dist[~valid] = np.inf
 
             # Ratios from OpenCV Stitcher docs
-            matches = [m for m, n in matches if m.distance < 0.65 * n.distance]
+            order = np.argsort(dist, axis=1)[:, :2]
+            best = np.take_along_axis(dist, order[:, :1], axis=1)[:, 0]
+            second = np.take_along_axis(dist, order[:, 1:2], axis=1)[:, 0]
+            good = np.isfinite(second) & (best < 0.65 * second)
 
-            if len(matches) >= 10:
-                dy = []
-                dx = []
-                for match in matches:
+            matched_query.append(queries[good])
+            matched_train.append(train_idx[candidates[good, order[good, 0]]])
 
-                    x1, y1 = self.keypoints[match.queryIdx].pt
-                    x2, y2 = other.keypoints[match.trainIdx].pt
+        matched_query = np.concatenate(matched_query)
+        matched_train = np.concatenate(matched_train)
 
-                    dy.append(y1 - y2)
-                    dx.append(x1 - x2)
+        dy = pts_other[matched_train, 1] - pts_self[matched_query, 1]
+        dx = pts_other[matched_train, 0] - pts_self[matched_query, 0]
+        return dy, dx
 
-                if self._within_n_pixels(dy, dx, 5) > 0.5:
-                    self.y = other.y - np.median(dy)
-                    self.x = other.x - np.median(dx)
+    @staticmethod
+    def _descriptor_distances(queries, candidates, binary=False):
+        """Calculates distances between descriptors and their candidate matches
+
+        Parameters
+        ----------
+        queries : numpy.ndarray
+            descriptors with shape (n, d)
+        candidates : numpy.ndarray
+            candidate descriptors for each query with shape (n, k, d)
+        binary : bool
+            whether the descriptors are binary strings packed into uint8
+
+        Returns
+        -------
+        numpy.ndarray
+            euclidean distances, or Hamming distances for binary descriptors,
+            with shape (n, k)
+        """
+        if binary:
+            diff = np.bitwise_xor(candidates, queries[:, np.newaxis, :])
+            return np.unpackbits(diff, axis=2).sum(axis=2, dtype=np.float32)
+
+        diff = candidates.astype(np.float32) - queries[:, np.newaxis, :].astype(np.float32)
+        return np.sqrt(np.einsum("nkd,nkd->nk", diff, diff))
+
+    def align_to(self, other, window=None, constrained=True, **kwargs):
+        """Aligns tile to another, already placed tile
+
+        Parameters
+        ----------
+        other : Tile
+            a tile that has already been placed in the mosaic
+        window : float
+            if given, bounds the search to this many pixels around the
+            position predicted by the stage priors. See estimate_offset.
+        constrained : bool
+            whether to restrict matching to the predicted overlap. See
+            estimate_offset.
+
+        Returns
+        -------
+        OpenCVTile
+            the original tile updated with x and y coordinates
+        """
+
+        offset = self.estimate_offset(other, window=window, constrained=constrained, **kwargs)
+        if offset is not None:
+            self.y = other.y + offset[0]
+            self.x = other.x + offset[1]
 
         return self
 
@@ -1859,6 +2748,149 @@ class MemmapOpenCVTile(MemmapTile):
         cv.destroyAllWindows()
 
 
+class MemmapPhaseCorrelationTile(MemmapOpenCVTile):
+    """A memmapped tile aligned to its neighbors by phase correlation of their overlap
+
+    Neighbors in a regular grid differ only by a translation, so the shift
+    between two tiles can be read from the cross-power spectrum of the strips
+    where they are expected to overlap. Features are only detected and
+    matched for pairs where the correlation peak is too weak to trust.
+
+    See Tile for available attributes.
+    """
+
+    #: float : minimum peak response for a phase-correlation offset to be trusted
+    min_confidence = 0.1
+
+    #: int : minimum height and width of an overlap strip in pixels of the alignment plane
+    min_strip_size = 32
+
+    def detect_and_extract(self, *args, **kwargs):
+        """Marks the tile as ready to align
+
+        Features are detected lazily, only when phase correlation fails for
+        a pair. See extract_features.
+
+        Returns
+        -------
+        MemmapPhaseCorrelationTile
+            the original tile
+        """
+        if self.features_detected is None:
+            self.features_detected = True
+        return self
+
+    def extract_features(self):
+        """Detects and extracts features for the feature-matching fallback
+
+        Returns
+        -------
+        MemmapPhaseCorrelationTile
+            the original tile updated with features and keypoints
+        """
+        if self.descriptors is None and not self.features_stored:
+            try:
+                self.set_features(
+                    *self._detect_in_regions(
+                        self.get_aligndata(), self.overlap_regions(), self.plane_scale
+                    )
+                )
+            except KeyError:
+                pass
+        return self
+
+    def phase_correlate(self, other, expected):
+        """Estimates the offset to another tile by phase correlation of their overlap
+
+        Parameters
+        ----------
+        other : Tile
+            another tile in the mosaic
+        expected : tuple
+            expected offset as (dy, dx), used to cut out the overlap strips.
+            See expected_offset.
+
+        Returns
+        -------
+        tuple
+            offset as (dy, dx) and the height of the correlation peak, which
+            is close to 1 for a clean match and close to 0 for none. The
+            offset is None if the predicted overlap is too small.
+        """
+        # Work in the coordinates of the alignment planes
+        scale = self.plane_scale
+        imdata = self.get_aligndata()
+        other_imdata = other.get_aligndata()
+        ey, ex = int(round(expected[0] * scale)), int(round(expected[1] * scale))
+
+        # Overlap in the coordinates of this tile
+        y1, y2 = max(0, -ey), min(imdata.shape[0], other_imdata.shape[0] - ey)
+        x1, x2 = max(0, -ex), min(imdata.shape[1], other_imdata.shape[1] - ex)
+        if min(y2 - y1, x2 - x1) < self.min_strip_size:
+            return None, 0.0
+
+        strip = self._strip(imdata[y1:y2, x1:x2])
+        other_strip = self._strip(other_imdata[y1 + ey:y2 + ey, x1 + ex:x2 + ex])
+
+        # The peak is located to sub-pixel precision from its weighted centroid
+        window = cv.createHanningWindow((x2 - x1, y2 - y1), cv.CV_32F)
+        (shift_x, shift_y), response = cv.phaseCorrelate(strip, other_strip, window)
+
+        return ((ey + shift_y) / scale, (ex + shift_x) / scale), response
+
+    def estimate_offset(self, other, window=None, constrained=True, **kwargs):
+        """Estimates the position of this tile relative to another tile
+
+        Uses phase correlation where the overlap can be predicted and falls
+        back to feature matching for pairs with a weak correlation peak or
+        an offset too far from the prediction.
+
+        Parameters
+        ----------
+        other : Tile
+            another tile in the mosaic
+        window : float
+            maximum distance in pixels between the offset and the one
+            predicted by the stage priors. See MemmapOpenCVTile.estimate_offset.
+        constrained : bool
+            whether to restrict feature matching to the predicted overlap.
+            See MemmapOpenCVTile.estimate_offset.
+        **kwargs :
+            any keyword argument accepted by the knnMatch method on the matcher
+
+        Returns
+        -------
+        tuple
+            offset as (dy, dx) such that this tile sits at other.y + dy,
+            other.x + dx, or None if the tiles could not be matched
+        """
+        expected = self.expected_offset(other)
+        if expected is not None:
+            offset, confidence = self.phase_correlate(other, expected)
+            radius = window if window is not None else self.search_radius * max(self.height, self.width)
+            if (
+                offset is not None
+                and confidence >= self.min_confidence
+                and abs(offset[0] - expected[0]) <= radius
+                and abs(offset[1] - expected[1]) <= radius
+            ):
+                return offset
+
+        # Fall back to feature matching for low-confidence pairs
+        self.extract_features()
+        other.extract_features()
+        if self.descriptors is None or other.descriptors is None:
+            return None
+        return super().estimate_offset(other, window=window, constrained=constrained, **kwargs)
+
+    @staticmethod
+    def _strip(imdata):
+        """Converts a crop of a tile to a single-channel float32 array"""
+        if imdata.ndim == 3:
+            imdata = cv.cvtColor(np.ascontiguousarray(imdata), cv.COLOR_BGR2GRAY)
+        return np.float32(imdata)
+
+
 class ScikitImageTile(Tile):
     """An image tile in a mosaic loaded and manipulated using scikit-image
 